@@ -20,9 +20,11 @@
 """ Conversion script for the LDM checkpoints. """
 
 import argparse
+import inspect
 import logging
 import os
 import re
+import zipfile
 
 import torch
 import yaml
@@ -1007,10 +1009,14 @@ def convert_open_clip_checkpoint(checkpoint):
     return text_model
 
 
+from safetensors.torch import load as torch_safe_load
 from safetensors.torch import load_file as torch_safe_load_file
 
 from gyre.constants import GYRE_BASE_PATH
 
+# torch.load(mmap=True) and load_state_dict(assign=True) both arrived in torch 2.1
+TORCH_SUPPORTS_MMAP = "mmap" in inspect.signature(torch.load).parameters
+
 
 class Config:
     def __init__(self, data):
@@ -1048,13 +1054,29 @@ def load_as_models(
     whitelist=None,
     device="cpu",
     dtype=None,
+    mmap=True,
 ):
     if ckpt_path:
+        load_kwargs = {}
+        # Only the zip-based format can be memory-mapped, not legacy tar files
+        if mmap and TORCH_SUPPORTS_MMAP and zipfile.is_zipfile(ckpt_path):
+            load_kwargs["mmap"] = True
+
         checkpoint = torch.load(
-            ckpt_path, map_location=device, pickle_module=torch_safe_unpickler
+            ckpt_path,
+            map_location=device,
+            pickle_module=torch_safe_unpickler,
+            **load_kwargs,
         )
-    elif safetensors_path:
+    elif safetensors_path and mmap:
         checkpoint = torch_safe_load_file(safetensors_path, device=device)
+    elif safetensors_path:
+        # Read the file in one sequential pass rather than faulting in pages
+        # of a mapping, which is much faster on network filesystems
+        with open(safetensors_path, "rb") as f:
+            checkpoint = torch_safe_load(f.read())
+        if device != "cpu":
+            checkpoint = {k: v.to(device) for k, v in checkpoint.items()}
     else:
         raise ValueError("Must provide one of ckpt_path or safetensors_path")
 
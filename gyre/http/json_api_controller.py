@@ -1,4 +1,7 @@
+import functools
 import json
+import logging
+import time
 
 from accept_types import get_best_match
 from twisted.web import resource
@@ -6,6 +9,36 @@ from twisted.web.error import Error as WebError
 from twisted.web.resource import ErrorPage, NoResource
 from twisted.web.server import NOT_DONE_YET
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def json_dumps(value) -> bytes:
+    """Serialise value to utf-8 encoded JSON, using orjson if it's available"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value).encode("utf-8")
+
+
+def json_loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+@functools.lru_cache(maxsize=512)
+def negotiate_return_type(accept_header: str, offer_types: tuple[str, ...]):
+    """
+    Find the best of offer_types for an accept header. Clients tend to send
+    the same handful of accept headers, so the result is memoised.
+    """
+    # get_best_match only iterates over the offered types, so a tuple is fine
+    return get_best_match(accept_header, offer_types)
+
 
 class NotAcceptableResource(ErrorPage):
     def __init__(
@@ -21,66 +54,177 @@ class UnsupportedMediaTypeResource(ErrorPage):
         super().__init__(415, "Unsupported Media Type", message)
 
 
+# Media types accepted as a JSON request body
+_JSON_CONTENT_TYPES = frozenset({b"application/json"})
+
+# Error pages with fixed content are stateless, so can be shared between requests
+_NO_RESOURCE = NoResource()
+_NOT_ACCEPTABLE = NotAcceptableResource()
+_UNSUPPORTED_MEDIA = UnsupportedMediaTypeResource()
+_INTERNAL_ERROR = ErrorPage(500, b"Internal Error", b"")
+
+# How to turn an exception raised by a handler into an error page
+_ERROR_PAGES = {
+    ValueError: lambda e: ErrorPage(400, str(e), b""),
+    WebError: lambda e: ErrorPage(int(e.status), e.message, b""),
+    Exception: lambda e: _INTERNAL_ERROR,
+}
+
+
+def error_page_for(exception: Exception) -> ErrorPage:
+    for klass in type(exception).__mro__:
+        if (factory := _ERROR_PAGES.get(klass)) is not None:
+            return factory(exception)
+
+    return _INTERNAL_ERROR
+
+
 class JSONAPIController(resource.Resource):
     preferred_return_type = "application/json"
     return_types = {"application/json"}
 
+    # Types offered during accept negotiation, precomputed per class
+    _offer_types: tuple[str, ...] = (preferred_return_type, *return_types)
+    _content_type_headers: dict[str, bytes] = {
+        return_type: return_type.encode("latin-1") for return_type in _offer_types
+    }
+
+    # Handlers, resolved once per class rather than on every request
+    _handle_GET = None
+    _handle_POST = None
+
+    # Set to True if handlers need the negotiated return type, in which case
+    # they're called as handler(request, input, return_type)
+    handler_takes_return_type = False
+
+    # Seconds to cache successful GET responses for. 0 disables caching. The
+    # cache is keyed on the URI, Accept header and the caller's credentials
+    # (Authorization and Cookie headers), so only enable it for responses that
+    # depend on nothing else about the request
+    cache_ttl: float = 0
+    cache_max_entries = 256
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._offer_types = (cls.preferred_return_type, *cls.return_types)
+        cls._content_type_headers = {
+            return_type: return_type.encode("latin-1")
+            for return_type in cls._offer_types
+        }
+        cls._handle_GET = getattr(cls, "handle_GET", None)
+        cls._handle_POST = getattr(cls, "handle_POST", None)
+        cls._response_cache = {}
+
     def _render_common(self, request, handler, input):
         if not handler:
-            return NoResource().render(request)
+            return _NO_RESOURCE.render(request)
 
         # Calculate what (if any) return type matches the accept header
         return_type = None
         accept_header = request.getHeader("accept")
 
         if accept_header:
-            return_type = get_best_match(
-                accept_header, [self.preferred_return_type] + list(self.return_types)
-            )
+            return_type = negotiate_return_type(accept_header, self._offer_types)
 
         # If none, throw an error
         if not return_type:
-            return NotAcceptableResource().render(request)
-
-        # Otherwise reset the request accept header to just the return type
-        request.requestHeaders.setRawHeaders("accept", [return_type])
+            return _NOT_ACCEPTABLE.render(request)
 
         try:
-            response = handler(request, input)
-        except ValueError as e:
-            return ErrorPage(400, str(e), b"").render(request)
-        except WebError as e:
-            return ErrorPage(int(e.status), e.message, b"").render(request)
+            if self.handler_takes_return_type:
+                response = handler(request, input, return_type)
+            else:
+                response = handler(request, input)
         except Exception as e:
-            print(f"Exception in JSON controller {self.__class__.__name__}. ", e)
-            return ErrorPage(500, b"Internal Error", b"").render(request)
+            page = error_page_for(e)
+            if page is _INTERNAL_ERROR:
+                logger.exception(
+                    "Exception in JSON controller %s", self.__class__.__name__
+                )
+            return page.render(request)
 
-        # Handle when a controller returns NOT_DONE_YET because it's
-        # still working in the background
-        if response is NOT_DONE_YET:
-            return NOT_DONE_YET
+        response_type = type(response)
 
-        # Convert dict or object instances into json strings
-        if isinstance(response, dict):
-            response = json.dumps(response)
+        # Handlers that have already serialised their response are passed
+        # straight through, so check for that first
+        if response_type is bytes:
+            pass
 
         # JSON is always encoded as utf-8
-        if isinstance(response, str):
+        elif response_type is str:
             response = response.encode("utf-8")
 
+        # Handle when a controller returns NOT_DONE_YET because it's
+        # still working in the background
+        elif response is NOT_DONE_YET:
+            return NOT_DONE_YET
+
+        # Anything else (dicts and subclasses, lists, tuples, etc) is encoded
+        # as json (already utf-8 encoded)
+        else:
+            try:
+                response = json_dumps(response)
+            except TypeError:
+                logger.exception(
+                    "Unserialisable response in JSON controller %s",
+                    self.__class__.__name__,
+                )
+                return _INTERNAL_ERROR.render(request)
+
         # And return it
-        request.setHeader("content-type", return_type)
+        request.responseHeaders.setRawHeaders(
+            b"content-type", [self._content_type_headers[return_type]]
+        )
         return response
 
     def render_GET(self, request):
-        handler = getattr(self, "handle_GET", None)
-        return self._render_common(request, handler, None)
+        if not self.cache_ttl:
+            return self._render_common(request, self._handle_GET, None)
+
+        now = time.monotonic()
+        key = (
+            request.uri,
+            request.getHeader("accept"),
+            request.getHeader("authorization"),
+            request.getHeader("cookie"),
+        )
+
+        cached = self._response_cache.get(key)
+        if cached is not None and cached[0] > now:
+            _, content_type, body = cached
+            request.responseHeaders.setRawHeaders(b"content-type", [content_type])
+            return body
+
+        response = self._render_common(request, self._handle_GET, None)
+
+        if type(response) is bytes and request.code == 200:
+            cache = self._response_cache
+            # When full, drop expired entries, or everything if none have expired
+            if len(cache) >= self.cache_max_entries:
+                expired = [k for k, (expires, *_) in cache.items() if expires <= now]
+                for k in expired:
+                    del cache[k]
+                if not expired:
+                    cache.clear()
+
+            content_type = request.responseHeaders.getRawHeaders(b"content-type")[0]
+            cache[key] = (now + self.cache_ttl, content_type, response)
 
-    def render_POST(self, request):
-        handler = getattr(self, "handle_POST", None)
+        return response
 
-        content_type_header = request.getHeader("content-type")
-        if not content_type_header or content_type_header != "application/json":
-            return UnsupportedMediaTypeResource().render(request)
+    def render_POST(self, request):
+        # Compare the raw bytes, ignoring parameters like "; charset=utf-8"
+        content_type_header = request.requestHeaders.getRawHeaders(
+            b"content-type", [b""]
+        )[0]
+        media_type = content_type_header.partition(b";")[0].strip().lower()
+        if media_type not in _JSON_CONTENT_TYPES:
+            return _UNSUPPORTED_MEDIA.render(request)
+
+        # request.content is already fully buffered, so parse it in one go
+        try:
+            input = json_loads(request.content.read())
+        except ValueError as e:
+            return ErrorPage(400, f"Invalid JSON body: {e}", b"").render(request)
 
-        return self._render_common(request, handler, json.load(request.content))
+        return self._render_common(request, self._handle_POST, input)
@@ -1,4 +1,3 @@
-import json
 import uuid
 from base64 import b64encode
 
@@ -33,6 +32,7 @@ from gyre.http.grpc_gateway_controller import GRPCGatewayContext
 from gyre.http.json_api_controller import (
     JSONAPIController,
     UnsupportedMediaTypeResource,
+    json_loads,
 )
 
 
@@ -70,6 +70,7 @@ class StabilityRESTAPI_EnginesController(JSONAPIController):
 class StabilityRESTAPI_GenerationController(JSONAPIController):
     preferred_return_type = "image/png"
     return_types = {"application/json", "image/png"}
+    handler_takes_return_type = True
 
     def __init__(self, servicer, engineid, gentype):
         self._servicer = servicer
@@ -114,7 +115,7 @@ class StabilityRESTAPI_GenerationController(JSONAPIController):
             content_type, options = multipart.parse_options_header(content_type_header)
 
             if content_type == "application/json":
-                content = {"options": json.load(request.content)}
+                content = {"options": json_loads(request.content.read())}
 
             elif content_type == "multipart/form-data":
                 parser = multipart.MultipartParser(request.content, options["boundary"])
@@ -127,7 +128,7 @@ class StabilityRESTAPI_GenerationController(JSONAPIController):
                     elif part.name == "mask_image" and part.content.type == "image/png":
                         content["mask_image"] = part.raw
                     elif part.name == "options":
-                        content["options"] = json.load(part.file)
+                        content["options"] = json_loads(part.raw)
                     elif part.name.startswith("text_prompts"):
                         idx, label = regex.findall(r"\[(.*?)\]", part.name)
                         prompt = text_prompts.setdefault(idx, {})
@@ -228,7 +229,7 @@ class StabilityRESTAPI_GenerationController(JSONAPIController):
         else:
             raise ValueError("masking requires a mask_source parameter")
 
-    def _handle_generate(self, http_request, data):
+    def _handle_generate(self, http_request, data, return_type):
         if not self._servicer:
             raise WebError(503, "Not ready yet")
 
@@ -239,8 +240,7 @@ class StabilityRESTAPI_GenerationController(JSONAPIController):
         if not options:
             raise ValueError("No options provided. Please check API docs.")
 
-        accept_header = http_request.getHeader("accept")
-        is_png = accept_header == "image/png"
+        is_png = return_type == "image/png"
 
         request = Request(
             engine_id=self._engineid.decode("utf-8"), request_id=str(uuid.uuid4())
@@ -384,16 +384,14 @@ class StabilityRESTAPI_GenerationController(JSONAPIController):
             http_request.setHeader("seed", str(seeds[0]))
             return images[0]
         else:
-            return json.dumps(
-                [
-                    {
-                        "base64": b64encode(image).decode("ascii"),
-                        "finishReason": reason,
-                        "seed": seed,
-                    }
-                    for image, reason, seed in zip(images, finish, seeds)
-                ]
-            )
+            return [
+                {
+                    "base64": b64encode(image).decode("ascii"),
+                    "finishReason": reason,
+                    "seed": seed,
+                }
+                for image, reason, seed in zip(images, finish, seeds)
+            ]
 
 
 class StabilityRESTAPI_GenerationRouter(resource.Resource):
@@ -1,3 +1,4 @@
+import copy
 import gc
 import glob
 import hashlib
@@ -5,15 +6,19 @@ import importlib
 import inspect
 import itertools
 import json
+import logging
 import math
 import os
 import queue
+import re
 import shutil
 import tempfile
-from collections import Counter
-from contextlib import contextmanager
-from dataclasses import dataclass
-from fnmatch import fnmatch
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from fnmatch import translate as fnmatch_translate
+from functools import cached_property, lru_cache
 from queue import Queue
 from types import SimpleNamespace as SN
 from typing import Any, Iterable, Literal, Optional, Union
@@ -21,18 +26,21 @@ from urllib.parse import urlparse
 
 import generation_pb2
 import huggingface_hub
+import numpy as np
+import requests
 import torch
+from accelerate.utils import set_module_tensor_to_device
 from diffusers import ModelMixin, UNet2DConditionModel, pipelines
 from diffusers.configuration_utils import FrozenDict
 from diffusers.pipeline_utils import DiffusionPipeline, is_safetensors_compatible
 from diffusers.utils import deprecate
-from huggingface_hub.file_download import http_get
 from tqdm.auto import tqdm
 from transformers import CLIPModel, PreTrainedModel
 
 from gyre import ckpt_utils
 from gyre.constants import sd_cache_home
-from gyre.pipeline.model_utils import GPUExclusionSet, clone_model
+from gyre.pipeline.model_utils import GPUExclusionSet, clone_model, pin_model
+from gyre.pipeline_pool import EVICTION_POLICIES, ActivePipelines, DeviceSlotQueue
 from gyre.pipeline.samplers import build_sampler_set
 from gyre.pipeline.unified_pipeline import (
     SCHEDULER_NOISE_TYPE,
@@ -40,6 +48,14 @@ from gyre.pipeline.unified_pipeline import (
     UnifiedPipelinePromptType,
 )
 
+logger = logging.getLogger(__name__)
+
+# Pickled weight files, as saved by diffusers and transformers respectively
+PICKLED_WEIGHT_NAMES = ("diffusion_pytorch_model.bin", "pytorch_model.bin")
+
+# File extensions that might hold model weights in a HuggingFace repo
+WEIGHT_EXTENSIONS = frozenset({"ckpt", "bin", "pt", "safetensors", "msgpack", "h5"})
+
 DEFAULT_LIBRARIES = {
     "StableDiffusionPipeline": "stable_diffusion",
     "UnifiedPipeline": "gyre.pipeline.unified_pipeline",
@@ -67,20 +83,37 @@ TYPE_CLASSES = {
 
 class ProgressBarWrapper(object):
     class InternalTqdm(tqdm):
+        # Minimum seconds between progress callbacks (except for the final one)
+        callback_interval = 0.1
+
         def __init__(self, progress_callback, stop_event, suppress_output, iterable):
             self._progress_callback = progress_callback
             self._stop_event = stop_event
+            self._last_callback = 0.0
             super().__init__(iterable, disable=suppress_output)
 
         def update(self, n=1):
             displayed = super().update(n)
             if displayed and self._progress_callback:
-                self._progress_callback(**self.format_dict)
+                # Only build format_dict when we're actually going to call back
+                now = time.monotonic()
+                finished = self.total is not None and self.n >= self.total
+                if finished or now - self._last_callback >= self.callback_interval:
+                    self._last_callback = now
+                    self._progress_callback(**self.format_dict)
             return displayed
 
         def __iter__(self):
+            stop_event = self._stop_event
+
+            if not stop_event:
+                yield from super().__iter__()
+                return
+
+            # Check every iteration - each one is usually a whole sampler step,
+            # so checking less often would noticeably delay aborting
             for x in super().__iter__():
-                if self._stop_event and self._stop_event.is_set():
+                if stop_event.is_set():
                     self.set_description("ABORTED")
                     break
                 yield x
@@ -97,13 +130,25 @@ class ProgressBarWrapper(object):
 
 
 class EngineMode(object):
-    def __init__(self, vram_optimisation_level=0, enable_cuda=True, enable_mps=False):
+    def __init__(
+        self,
+        vram_optimisation_level=0,
+        enable_cuda=True,
+        enable_mps=False,
+        mmap_load=True,
+        fast_math=False,
+        pin_memory=False,
+    ):
         self._vramO = vram_optimisation_level
         self._enable_cuda = enable_cuda
         self._enable_mps = enable_mps
+        self._mmap_load = mmap_load
+        self._fast_math = fast_math
+        self._pin_memory = pin_memory
 
-    @property
+    @cached_property
     def device(self):
+        # Device availability doesn't change while running, so only probe once
         self._hasCuda = (
             self._enable_cuda
             and getattr(torch, "cuda", False)
@@ -136,6 +181,18 @@ class EngineMode(object):
     def all_exclusion(self):
         return self.device == "cuda" and self._vramO > 4
 
+    @property
+    def mmap_load(self):
+        return self._mmap_load
+
+    @property
+    def fast_math(self):
+        return self.device == "cuda" and self._fast_math
+
+    @property
+    def pin_memory(self):
+        return self.device == "cuda" and self._pin_memory
+
 
 class BatchMode:
     def __init__(self, autodetect=False, points=None, simplemax=1, safety_margin=0.2):
@@ -144,28 +201,85 @@ class BatchMode:
         self.simplemax = simplemax
         self.safety_margin = safety_margin
 
+    @property
+    def points(self):
+        return self._points
+
+    @points.setter
+    def points(self, points):
+        self._points = points
+
+        # Split into (sorted) pixel and batchmax arrays for fast lookup
+        if points:
+            self._pixels = np.asarray([point[0] for point in points], dtype=np.int64)
+            self._batchmax = np.asarray([point[1] for point in points], dtype=np.int64)
+        else:
+            self._pixels = self._batchmax = None
+
     def batchmax(self, pixels):
         if self.points:
             # If pixels less than first point, return that max
-            if pixels <= self.points[0][0]:
-                return self.points[0][1]
+            if pixels <= self._pixels[0]:
+                return int(self._batchmax[0])
 
-            # Linear interpolate between bracketing points
-            pairs = zip(self.points[:-1], self.points[1:])
-            for pair in pairs:
-                if pixels >= pair[0][0] and pixels <= pair[1][0]:
-                    i = (pixels - pair[0][0]) / (pair[1][0] - pair[0][0])
-                    return math.floor(pair[0][1] + i * (pair[1][1] - pair[0][1]))
+            # Find the first point at or above pixels
+            i = int(np.searchsorted(self._pixels, pixels))
 
             # Off top of points - assume max of 1
-            return 1
+            if i == len(self._pixels):
+                return 1
+
+            # Linear interpolate between bracketing points
+            p0, p1 = self._pixels[i - 1], self._pixels[i]
+            b0, b1 = self._batchmax[i - 1], self._batchmax[i]
+            return math.floor(b0 + (pixels - p0) / (p1 - p0) * (b1 - b0))
 
         if self.simplemax is not None:
             return self.simplemax
 
         return 1
 
-    def run_autodetect(self, manager, resmax=2048, resstep=256):
+    def _try_batch(self, manager, params, b):
+        print(f"Trying {b}")
+        try:
+            with manager.with_engine() as pipe:
+                pipe.generate(["A Crocodile"] * b, params, suppress_output=True)
+        except Exception:
+            return False
+        else:
+            return True
+        finally:
+            # Don't let fragmentation from this attempt affect the next one
+            gc.collect()
+            torch.cuda.empty_cache()
+
+    def _predict_batch(self, manager, params, r):
+        """
+        Estimate the max batch size from the peak memory used by batches of 1
+        and 2, extrapolated to the memory available. Returns None if no estimate
+        can be made.
+        """
+        if r <= 3:
+            return None
+
+        peaks = []
+        for b in (1, 2):
+            torch.cuda.reset_peak_memory_stats()
+            if not self._try_batch(manager, params, b):
+                return None
+            peaks.append(torch.cuda.max_memory_allocated())
+
+        per_image = peaks[1] - peaks[0]
+        if per_image <= 0:
+            return None
+
+        # set_per_process_memory_fraction limits us to a fraction of the total
+        _, total = torch.cuda.mem_get_info()
+        available = total * (1 - self.safety_margin) - (peaks[0] - per_image)
+
+        return max(2, min(r - 1, int(available // per_image)))
+
+    def run_autodetect(self, manager, resmax=2048, resstep=256, reserve=0):
         torch.cuda.set_per_process_memory_fraction(1 - self.safety_margin)
 
         params = SN(
@@ -187,25 +301,41 @@ class BatchMode:
         for x in range(512, resmax, resstep):
             params.width = x
             print(f"Determining max batch for {x}")
-            # Quick binary search
-            r = l  # Start with the max from the previous run
+            r = l  # Upper bound is the max from the previous run
             l = 1
 
+            # Try the max predicted from memory use first. If it works, we're done,
+            # otherwise it's at least an upper bound for the search
+            # (predicting runs batches of 1 and 2, so those are known to work)
+            predicted = self._predict_batch(manager, params, r)
+            if predicted is not None:
+                if self._try_batch(manager, params, predicted):
+                    l, r = predicted, predicted + 1
+                else:
+                    l, r = 2, predicted
+
+            # Double from the last success until a batch size fails. Most failures
+            # are then close to the real max, rather than in the middle of a wide range
+            b = l * 2
+            while b < r:
+                if not self._try_batch(manager, params, b):
+                    r = b
+                    break
+                l, b = b, b * 2
+
+            # Then binary search between the last success and first failure
             while l < r - 1:
                 b = (l + r) // 2
-                print(f"Trying {b}")
-                try:
-                    with manager.with_engine() as pipe:
-                        pipe.generate(["A Crocodile"] * b, params, suppress_output=True)
-                except Exception as e:
-                    r = b
-                else:
+                if self._try_batch(manager, params, b):
                     l = b
+                else:
+                    r = b
 
             print(f"Max for {x} is {l}")
 
             pixels.append(params.width * params.height)
-            batchmax.append(l)
+            # Optionally leave some headroom for allocator fragmentation
+            batchmax.append(max(1, l - reserve))
 
             if l == 1:
                 print(f"Max res is {x}x512")
@@ -220,13 +350,47 @@ class BatchMode:
         torch.cuda.set_per_process_memory_fraction(1.0)
 
 
+# Bytes of unused (cached) CUDA memory to allow before releasing it on deactivate
+EMPTY_CACHE_THRESHOLD = 512 * 1024 * 1024
+
+
+class StreamPool:
+    """
+    Reusable CUDA side streams for each device, so they're created once and
+    shared between pipelines rather than created per pipeline
+    """
+
+    def __init__(self):
+        self._pools: dict[torch.device, queue.SimpleQueue] = {}
+
+    def get(self, device) -> torch.cuda.Stream:
+        device = torch.device(device)
+        pool = self._pools.setdefault(device, queue.SimpleQueue())
+
+        try:
+            return pool.get_nowait()
+        except queue.Empty:
+            return torch.cuda.Stream(device)
+
+    def put(self, device, stream: torch.cuda.Stream):
+        self._pools[torch.device(device)].put(stream)
+
+
 class PipelineWrapper:
-    def __init__(self, id, mode, pipeline):
+    def __init__(self, id, mode, pipeline, stream_pool=None):
         self._id = id
         self._mode = mode
 
         self._pipeline = pipeline
         self._previous = None
+        self._device = None
+
+        # The set of modules doesn't change, so find them once rather than parsing
+        # the pipeline config on every activate / deactivate
+        self._module_names = self._find_module_names()
+
+        # Side streams used to copy modules on activation
+        self._stream_pool = stream_pool if stream_pool is not None else StreamPool()
 
     @property
     def id(self):
@@ -236,45 +400,99 @@ class PipelineWrapper:
     def mode(self):
         return self._mode
 
-    def pipeline_modules(self):
+    def _find_module_names(self):
         pipeline_module_helper = getattr(self._pipeline, "pipeline_modules", None)
 
         if pipeline_module_helper:
-            for name, module in pipeline_module_helper():
-                yield name, module
+            return [name for name, _ in pipeline_module_helper()]
 
         else:
             module_names, *_ = self._pipeline.extract_init_dict(
                 dict(self._pipeline.config)
             )
-            for name in module_names.keys():
-                module = getattr(self._pipeline, name)
-                if isinstance(module, torch.nn.Module):
-                    yield name, module
+            return [
+                name
+                for name in module_names.keys()
+                if isinstance(getattr(self._pipeline, name), torch.nn.Module)
+            ]
+
+    def pipeline_modules(self):
+        for name in self._module_names:
+            yield name, getattr(self._pipeline, name)
+
+    @cached_property
+    def footprint(self):
+        """Roughly how many bytes of device memory activating this pipeline takes"""
+        return sum(
+            tensor.numel() * tensor.element_size()
+            for _, module in self.pipeline_modules()
+            if isinstance(module, torch.nn.Module)
+            for tensor in itertools.chain(module.parameters(), module.buffers())
+        )
 
     def _delay(self, name, module):
         return False
 
+    @property
+    def is_active(self):
+        return self._previous is not None
+
     def activate(self, device):
         if self._previous is not None:
             raise Exception("Activate called without previous deactivate")
 
         self._previous = {}
+        self._device = torch.device(device)
 
         exclusion_set = GPUExclusionSet(1)
 
-        for name, module in self.pipeline_modules():
-            self._previous[name] = module
+        # On CUDA, copy on a side stream so the copies of each module can
+        # overlap with cloning the next. The copies are only truly asynchronous
+        # from pinned memory, which is opt-in as it's never given back to the OS
+        copy_stream = None
+        if self._device.type == "cuda":
+            copy_stream = self._stream_pool.get(self._device)
+
+        # Modules whose tensors were allocated on the copy stream
+        copied = []
+
+        with torch.cuda.stream(copy_stream):
+            for name, module in self.pipeline_modules():
+                self._previous[name] = module
+
+                delay = self._delay(name, module)
+                if copy_stream and not delay and self._mode.pin_memory:
+                    pin_model(module)
+
+                # Clone from CPU to either CUDA or Meta with a hook to move to CUDA
+                cloned = clone_model(
+                    module,
+                    device,
+                    exclusion_set=exclusion_set if delay else None,
+                    non_blocking=copy_stream is not None,
+                )
 
-            # Clone from CPU to either CUDA or Meta with a hook to move to CUDA
-            cloned = clone_model(
-                module,
-                device,
-                exclusion_set=exclusion_set if self._delay(name, module) else None,
-            )
+                # And set it on the pipeline
+                setattr(self._pipeline, name, cloned)
+
+                if copy_stream and not delay and isinstance(cloned, torch.nn.Module):
+                    copied.append(cloned)
 
-            # And set it on the pipeline
-            setattr(self._pipeline, name, cloned)
+        # Make work queued on the current stream wait for the copies. This only
+        # orders the streams on the GPU, so activate returns as soon as the
+        # copies are queued and the caller's setup overlaps with them
+        if copy_stream:
+            compute_stream = torch.cuda.current_stream(device)
+            compute_stream.wait_stream(copy_stream)
+
+            # Tell the allocator these are in use on this stream too, so their
+            # memory isn't reused early once the pipeline is deactivated
+            for module in copied:
+                for tensor in itertools.chain(module.parameters(), module.buffers()):
+                    if tensor.device.type == "cuda":
+                        tensor.record_stream(compute_stream)
+
+            self._stream_pool.put(self._device, copy_stream)
 
     def deactivate(self):
         if self._previous is None:
@@ -286,16 +504,24 @@ class PipelineWrapper:
         self._previous = None
 
         gc.collect()
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
+
+        # Emptying the cache synchronises the device, so only do it once enough
+        # unused memory has built up in the allocator to be worth releasing
+        if self._device.type == "cuda":
+            reserved = torch.cuda.memory_reserved(self._device)
+            allocated = torch.cuda.memory_allocated(self._device)
+            if reserved - allocated > EMPTY_CACHE_THRESHOLD:
+                torch.cuda.empty_cache()
+
+        self._device = None
 
     def __call__(self, *args, **kwargs):
         return self._pipeline(*args, **kwargs)
 
 
 class GeneratePipelineWrapper(PipelineWrapper):
-    def __init__(self, id, mode, pipeline):
-        super().__init__(id, mode, pipeline)
+    def __init__(self, id, mode, pipeline, stream_pool=None):
+        super().__init__(id, mode, pipeline, stream_pool)
 
         if self.mode.attention_slice:
             self._pipeline.enable_attention_slicing("auto")
@@ -314,6 +540,29 @@ class GeneratePipelineWrapper(PipelineWrapper):
             include_kdiffusion=True,
         )
 
+        self._generators: list[torch.Generator] = []
+
+        # Which generate arguments the pipeline accepts, and the generate defaults
+        # (to check if an argument the pipeline doesn't accept was actually set)
+        self._pipeline_keys = frozenset(inspect.signature(self._pipeline).parameters)
+        self._generate_defaults = {
+            k: param.default
+            for k, param in inspect.signature(self.generate).parameters.items()
+        }
+
+    def _get_generators(self, count):
+        """
+        Get count generators to seed. They're kept and re-seeded on each request,
+        rather than creating new ones (a wrapper only runs one request at a time)
+        """
+        generators = self._generators
+        generator_device = "cpu" if self.mode.device == "mps" else self.mode.device
+
+        while len(generators) < count:
+            generators.append(torch.Generator(generator_device))
+
+        return generators[:count]
+
     def _prepScheduler(self, scheduler):
         if (
             hasattr(scheduler.config, "steps_offset")
@@ -403,12 +652,13 @@ class GeneratePipelineWrapper(PipelineWrapper):
     ):
         generator = None
 
-        generator_device = "cpu" if self.mode.device == "mps" else self.mode.device
-
         if isinstance(seed, Iterable):
-            generator = [torch.Generator(generator_device).manual_seed(s) for s in seed]
+            seed = list(seed)
+            generator = [
+                g.manual_seed(s) for g, s in zip(self._get_generators(len(seed)), seed)
+            ]
         elif seed > 0:
-            generator = torch.Generator(generator_device).manual_seed(seed)
+            generator = self._get_generators(1)[0].manual_seed(seed)
 
         if scheduler is None:
             samplers = self.get_samplers()
@@ -460,11 +710,9 @@ class GeneratePipelineWrapper(PipelineWrapper):
             return_dict=False,
         )
 
-        pipeline_keys = inspect.signature(self._pipeline).parameters.keys()
-        self_params = inspect.signature(self.generate).parameters
         for k, v in list(pipeline_args.items()):
-            if k not in pipeline_keys:
-                if v != self_params[k].default:
+            if k not in self._pipeline_keys:
+                if v != self._generate_defaults[k]:
                     print(
                         f"Warning: Pipeline doesn't understand argument {k} (set to {v}) - ignoring"
                     )
@@ -475,49 +723,75 @@ class GeneratePipelineWrapper(PipelineWrapper):
         return images
 
 
-class ModelSet(SN):
+class ModelSet:
+    __slots__ = ("_models", "_frozen")
+
     def __init__(self, **kwargs: Any) -> None:
-        super().__init__(**kwargs)
-        self.__frozen = False
+        object.__setattr__(self, "_models", kwargs)
+        object.__setattr__(self, "_frozen", False)
 
     def freeze(self):
-        self.__frozen = True
+        object.__setattr__(self, "_frozen", True)
 
-    def update(self, other: dict | SN):
-        if self.__frozen:
+    def update(self, other: "dict | ModelSet | SN"):
+        if self._frozen:
             raise ValueError("ModelSet is frozen")
 
-        if isinstance(other, SN):
+        if isinstance(other, ModelSet):
+            other = other._models
+        elif isinstance(other, SN):
             other = other.__dict__
 
-        self.__dict__.update(other)
+        self._models.update(other)
 
     def copy(self):
-        return ModelSet(**self.__dict__)
+        return ModelSet(**self._models)
 
     def get(self, key, default=None):
-        return self.__dict__.get(key, default)
+        return self._models.get(key, default)
 
     def keys(self):
-        return self.__dict__.keys()
+        return self._models.keys()
 
     def values(self):
-        return self.__dict__.values()
+        return self._models.values()
 
     def items(self):
-        return self.__dict__.items()
+        return self._models.items()
 
     def __contains__(self, item):
-        return item in self.__dict__
+        return item in self._models
 
     def __getitem__(self, key):
-        return self.__dict__[key]
+        return self._models[key]
 
     def __setitem__(self, key, value):
-        if self.__frozen:
+        if self._frozen:
             raise ValueError("ModelSet is frozen")
 
-        self.__dict__[key] = value
+        self._models[key] = value
+
+    def __getattr__(self, name):
+        # Use object.__getattribute__ to avoid recursion if _models isn't set yet
+        try:
+            return object.__getattribute__(self, "_models")[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+    def __repr__(self):
+        items = ", ".join(f"{k}={v!r}" for k, v in self._models.items())
+        return f"ModelSet({items})"
+
+    def __getstate__(self):
+        return self._models, self._frozen
+
+    def __setstate__(self, state):
+        models, frozen = state
+        object.__setattr__(self, "_models", models)
+        object.__setattr__(self, "_frozen", frozen)
 
 
 class EngineSpec:
@@ -525,43 +799,44 @@ class EngineSpec:
         if data is None:
             data = {}
 
+        # Specs are immutable, so derived properties below are cached
         self._data = {k.lower(): v for k, v in data.items()}
 
-    @property
+    @cached_property
     def human_id(self) -> str:
         if self.id:
             return f"Engine {self.id}"
         else:
             return f"Model {self.model_id}"
 
-    @property
+    @cached_property
     def is_engine(self) -> bool:
         return "id" in self._data
 
-    @property
+    @cached_property
     def is_model(self) -> bool:
         return "model_id" in self._data
 
-    @property
+    @cached_property
     def enabled(self) -> bool:
         return self._data.get("enabled", True)
 
-    @property
+    @cached_property
     def visible(self) -> bool:
         return self.enabled and self._data.get("visible", True)
 
-    @property
+    @cached_property
     def type(self) -> str:
         return self._data.get("type", "pipeline").lower()
 
-    @property
+    @cached_property
     def task(self) -> str | None:
         if self.type == "pipeline":
             return self._data.get("task", "generate").lower()
         else:
             return None
 
-    @property
+    @cached_property
     def class_name(self) -> str | None:
         default = None
 
@@ -573,18 +848,18 @@ class EngineSpec:
 
         return self._data.get("class", default)
 
-    @property
+    @cached_property
     def fp16(self) -> Literal["auto", "only", "local", "never", "prevent"]:
         res = self._data.get("fp16", "auto").lower()
         values = {"auto", "only", "local", "never", "prevent"}
         assert res in values, f"Invalid fp16 value {res}"
         return res
 
-    @property
+    @cached_property
     def model_is_empty(self) -> bool:
         return self.model and self.model == "@empty"
 
-    @property
+    @cached_property
     def model_is_reference(self) -> bool:
         return self.model and self.model[0] == "@"
 
@@ -611,10 +886,12 @@ class EngineSpec:
         return __name in self._data
 
 
-@dataclass
+# Slots are created once at startup and passed between requests for the life
+# of the manager, so they're kept small and fixed in shape
+@dataclass(slots=True)
 class DeviceQueueSlot:
     device: torch.device
-    pipeline: DiffusionPipeline | None = None
+    active: "ActivePipelines" = field(default_factory=lambda: ActivePipelines())
 
 
 class EngineNotFoundError(Exception):
@@ -625,8 +902,325 @@ class EngineNotReadyError(Exception):
     pass
 
 
+# Where the weight path each spec was last loaded from is remembered
+CANDIDATE_CACHE_PATH = os.path.join(sd_cache_home, "candidate_cache.json")
+
+# Where downloads are written before being moved into the cache
+DOWNLOAD_TEMP_PATH = os.path.join(sd_cache_home, "temp")
+
+# Read / write size when streaming downloads. Small chunks spend most of their
+# time in Python-level iteration rather than moving bytes
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Most connections to open at once when downloading, split between files
+# downloaded in parallel and ranged parts of each file
+DOWNLOAD_CONNECTIONS = 8
+
+
+def stream_http_get(session, url, temp_file, size=None):
+    """Download url into temp_file as a single stream, in large chunks"""
+    with session.get(url, stream=True, timeout=30) as r:
+        r.raise_for_status()
+        # Undo any transfer compression as we read from the raw stream
+        r.raw.decode_content = True
+
+        progress = tqdm(
+            total=size or None,
+            unit="B",
+            unit_scale=True,
+            desc=os.path.basename(urlparse(url).path),
+        )
+
+        try:
+            while chunk := r.raw.read(DOWNLOAD_CHUNK_SIZE):
+                temp_file.write(chunk)
+                progress.update(len(chunk))
+        finally:
+            progress.close()
+
+
+def parallel_http_get(
+    url, temp_file, parts=DOWNLOAD_CONNECTIONS, min_part_size=64 * 1024 * 1024
+):
+    """
+    Download url into temp_file using several concurrent ranged requests over
+    a shared connection pool. Falls back to a single stream if the server
+    doesn't support ranges, or the file is too small to be worth splitting.
+    """
+    with requests.Session() as session:
+        if parts < 2:
+            return stream_http_get(session, url, temp_file)
+
+        # Some hosts reject HEAD (or, like presigned S3 URLs, only sign GET),
+        # so any failure just means the download isn't split
+        try:
+            head = session.head(url, allow_redirects=True, timeout=30)
+        except requests.RequestException:
+            head = None
+
+        if head is None or not head.ok:
+            return stream_http_get(session, url, temp_file)
+
+        try:
+            size = int(head.headers.get("content-length", 0))
+        except ValueError:
+            size = 0
+        ranged = head.headers.get("accept-ranges", "").lower() == "bytes"
+
+        if not ranged or size < min_part_size * 2 or not hasattr(os, "pwrite"):
+            return stream_http_get(session, head.url, temp_file, size)
+
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=parts, pool_maxsize=parts
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        part_size = math.ceil(size / parts)
+        temp_file.truncate(size)
+        fd = temp_file.fileno()
+
+        progress = tqdm(
+            total=size,
+            unit="B",
+            unit_scale=True,
+            desc=os.path.basename(urlparse(url).path),
+        )
+
+        def fetch_part(start):
+            end = min(start + part_size, size) - 1
+            headers = {"Range": f"bytes={start}-{end}"}
+
+            with session.get(head.url, headers=headers, stream=True, timeout=30) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise EnvironmentError(f"Server ignored range request for {url}")
+
+                offset = start
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+                    progress.update(len(chunk))
+
+            if offset != end + 1:
+                raise EnvironmentError(f"Download of {url} was incomplete")
+
+        try:
+            with ThreadPoolExecutor(parts) as executor:
+                # Consume the results so any exception gets raised
+                list(executor.map(fetch_part, range(0, size, part_size)))
+        finally:
+            progress.close()
+
+
+def advise_willneed(path):
+    """
+    Tell the kernel a file is about to be read through from start to finish, so
+    it reads ahead aggressively rather than faulting in a mapping page by page
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@lru_cache(maxsize=None)
+def _compile_globs(patterns: tuple[str, ...]) -> re.Pattern | None:
+    """Combine a set of glob patterns into a single compiled regex"""
+    if not patterns:
+        return None
+
+    return re.compile("|".join(fnmatch_translate(pattern) for pattern in patterns))
+
+
+@lru_cache(maxsize=None)
+def _compile_patterns(patterns: tuple[str, ...]) -> re.Pattern | None:
+    """As _compile_globs, but with huggingface_hub's "dir/" meaning "dir/*" """
+    return _compile_globs(
+        tuple(
+            pattern + "*" if pattern.endswith("/") else pattern for pattern in patterns
+        )
+    )
+
+
+def filter_paths(
+    paths: Iterable[str],
+    allow_patterns: Iterable[str] | None = None,
+    ignore_patterns: Iterable[str] | None = None,
+) -> list[str]:
+    """
+    Same as huggingface_hub.utils.filter_repo_objects for a list of paths, but
+    matching against one compiled regex rather than fnmatch-ing every pattern
+    """
+    allow_re = _compile_patterns(tuple(allow_patterns) if allow_patterns else ())
+    ignore_re = _compile_patterns(tuple(ignore_patterns) if ignore_patterns else ())
+
+    return [
+        path
+        for path in paths
+        if (allow_re is None or allow_re.match(path))
+        and (ignore_re is None or not ignore_re.match(path))
+    ]
+
+
+@lru_cache(maxsize=256)
+def _cached_load_config(weight_path: str) -> dict:
+    """
+    Read a pipeline's model_index.json. Callers must treat the result as
+    read-only, as it's shared between calls
+    """
+    return DiffusionPipeline.load_config(weight_path, local_files_only=True)
+
+
+def smoothstep(x):
+    return x * x * (3 - (2 * x))
+
+
+def inv_smoothstep(x):
+    return 0.5 - math.sin(math.asin(1.0 - 2.0 * x) / 3.0)
+
+
+@lru_cache(maxsize=None)
+def import_class(fqclass_name: str | tuple[str, str]):
+    # You can pass in either a (dot seperated) string or a tuple of library, class
+    if isinstance(fqclass_name, str):
+        *library_name, class_name = fqclass_name.split(".")
+        library_name = ".".join(library_name)
+    else:
+        library_name, class_name = fqclass_name
+
+    if not library_name:
+        library_name = DEFAULT_LIBRARIES.get(class_name, None)
+
+    if not library_name:
+        raise EnvironmentError(f"Don't know the library name for class {class_name}")
+
+    # Is `library_name` a submodule of diffusers.pipelines?
+    is_pipeline_module = hasattr(pipelines, library_name)
+
+    if is_pipeline_module:
+        # If so, look it up from there
+        pipeline_module = getattr(pipelines, library_name)
+        class_obj = getattr(pipeline_module, class_name)
+    else:
+        # else we just import it from the library.
+        library = importlib.import_module(library_name)
+        class_obj = getattr(library, class_name, None)
+
+        # Backwards compatibility - if config asks for transformers.CLIPImageProcessor
+        # and we don't have it, use transformers.CLIPFeatureExtractor, that's the old name
+        if not class_obj:
+            if library_name == "transformers" and class_name == "CLIPImageProcessor":
+                class_obj = getattr(library, "CLIPFeatureExtractor", None)
+
+        if not class_obj:
+            raise EnvironmentError(
+                f"Config attempts to import {library}.{class_name} that doesn't appear to exist"
+            )
+
+    return class_obj
+
+
+@lru_cache(maxsize=32)
+def _meta_skeleton(class_obj, config_json: str) -> torch.nn.Module:
+    """
+    Build a model with all its parameters on the meta device, ready to have
+    real weights assigned in. Callers must deepcopy the result before filling
+    it, as it's shared between calls
+    """
+    config = json.loads(config_json)
+
+    with torch.device("meta"):
+        if issubclass(class_obj, ModelMixin):
+            return class_obj.from_config(config)
+        else:
+            return class_obj(class_obj.config_class.from_dict(config))
+
+
+@lru_cache(maxsize=64)
+def _sig_params(class_obj) -> tuple[frozenset[str], frozenset[str]]:
+    """
+    The parameters a pipeline class's __init__ accepts, and which of those
+    are required. inspect.signature is slow, so this is cached per class
+    """
+    params = inspect.signature(class_obj.__init__).parameters
+
+    expected = frozenset(params.keys()) - {"self"}
+    required = frozenset(
+        name
+        for name, param in params.items()
+        if param.default is inspect._empty
+        and name != "self"
+        and name != "safety_checker"
+    )
+
+    return expected, required
+
+
+def is_out_of_memory(exception: BaseException) -> bool:
+    # Older torch raises a plain RuntimeError rather than OutOfMemoryError
+    oom_class = getattr(torch.cuda, "OutOfMemoryError", None)
+    if oom_class is not None and isinstance(exception, oom_class):
+        return True
+
+    return isinstance(exception, RuntimeError) and "out of memory" in str(exception)
+
+
 def all_same(items):
-    return all(x == items[0] for x in items)
+    it = iter(items)
+    try:
+        first = next(it)
+    except StopIteration:
+        return True
+    return all(x == first for x in it)
+
+
+class EngineSession:
+    """
+    The context manager returned by EngineManager.with_engine. Holds a device
+    slot and a pipeline active on it for the duration of the with block.
+    """
+
+    __slots__ = ("_manager", "_spec", "_slot")
+
+    def __init__(self, manager: "EngineManager", spec: EngineSpec):
+        self._manager = manager
+        self._spec = spec
+        self._slot = None
+
+    def __enter__(self):
+        manager = self._manager
+
+        # Get device queue slot, and a pipeline active on it
+        slot = manager._device_queue.get(self._spec.id)
+        pipeline, self._slot, existing = manager._acquire_and_activate(self._spec, slot)
+
+        if existing is not None and logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "%s pipeline %s activated. %s",
+                "Existing" if existing else "New",
+                self._spec.id,
+                manager._ram_snapshot(),
+            )
+
+        return pipeline
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        # Release device handle
+        slot, self._slot = self._slot, None
+        slot.active.touch(self._spec.id)
+        self._manager._device_queue.put(slot)
 
 
 class EngineManager(object):
@@ -640,9 +1234,29 @@ class EngineManager(object):
         nsfw_behaviour="block",
         batchMode=BatchMode(),
         ram_monitor=None,
+        max_active_pipelines=1,
+        idle_ttl=None,
+        eviction_policy="lru",
     ):
         self.engines = [EngineSpec(engine) for engine in engines]
+
+        # Index specs by id and model_id, for lookups by exact name. Each entry
+        # is a list of (position in engines, spec) to keep the original order
+        self._engine_index: dict[str, dict[str, list[tuple[int, EngineSpec]]]] = {
+            "id": {},
+            "model_id": {},
+        }
+        for i, spec in enumerate(self.engines):
+            for key, index in self._engine_index.items():
+                if key in spec:
+                    index.setdefault(spec.get(key), []).append((i, spec))
+        # The spec with_engine uses for each id (the first, if repeated)
+        self._spec_by_id: dict[str, EngineSpec] = {
+            id: matches[0][1] for id, matches in self._engine_index["id"].items()
+        }
         self._defaults = {}
+        # Wrapped here rather than with a decorator so the cache is per manager
+        self._resolve_engine = lru_cache(maxsize=256)(self._resolve_engine)
 
         # Models that are explictly loaded with a model_id and can be referenced
         self._models = {}
@@ -654,6 +1268,7 @@ class EngineManager(object):
 
         self._weight_root = weight_root
         self._refresh_models = refresh_models
+        self._refresh_regex = _compile_globs(tuple(refresh_models or ()))
         self._refresh_on_error = refresh_on_error
 
         self._mode = mode
@@ -662,12 +1277,45 @@ class EngineManager(object):
         self._token = os.environ.get("HF_API_TOKEN", True)
 
         self._ram_monitor = ram_monitor
-
-        self._device_queue = Queue()
+        self._idle_ttl = idle_ttl
+        self._janitor = None
+
+        # Optional global CUDA settings - use TF32 tensor cores for fp32 matmuls
+        # and convolutions (Ampere+), and let cuDNN pick the fastest algorithms.
+        # Off by default, as TF32 changes fp32 results (so seeds won't reproduce
+        # exactly) and benchmarking re-runs for every new resolution
+        if self._mode.fast_math:
+            torch.backends.cuda.matmul.allow_tf32 = True
+            torch.backends.cudnn.allow_tf32 = True
+            torch.backends.cudnn.benchmark = True
+
+        if self._mode.device == "cuda":
+            # Pipelines of different sizes are activated and deactivated over
+            # time, which fragments fixed size allocator segments. Expandable
+            # segments (torch 2.1+) can grow and shrink instead. An explicit
+            # PYTORCH_CUDA_ALLOC_CONF takes precedence
+            if "PYTORCH_CUDA_ALLOC_CONF" not in os.environ and hasattr(
+                torch.cuda.memory, "_set_allocator_settings"
+            ):
+                torch.cuda.memory._set_allocator_settings("expandable_segments:True")
+
+        # CUDA side streams, shared by all pipelines
+        self._stream_pool = StreamPool()
+
+        # Hands out slots that already have the requested engine active first,
+        # and otherwise the most recently released slot
+        self._device_queue = DeviceSlotQueue()
         self._available_pipelines: dict[str, Queue] = {}
 
         for i in range(torch.cuda.device_count()):
-            self._device_queue.put(DeviceQueueSlot(device=torch.device("cuda", i)))
+            self._device_queue.put(
+                DeviceQueueSlot(
+                    device=torch.device("cuda", i),
+                    active=ActivePipelines(
+                        max_active_pipelines, EVICTION_POLICIES[eviction_policy]()
+                    ),
+                )
+            )
 
     @property
     def mode(self):
@@ -689,6 +1337,11 @@ class EngineManager(object):
         # Throw error if no such key in spec
         if not path:
             raise ValueError(f"No local model field was provided")
+        # Fast path for directories directly inside the weight root
+        if not os.path.isabs(path):
+            name = os.path.normpath(path)
+            if name in self._weight_root_dirs:
+                return os.path.normpath(os.path.join(self._weight_root, name))
         # Add path to weight root if not absolute
         if not os.path.isabs(path):
             path = os.path.join(self._weight_root, path)
@@ -700,6 +1353,18 @@ class EngineManager(object):
 
         return path
 
+    @cached_property
+    def _weight_root_dirs(self) -> frozenset[str]:
+        """
+        The directories directly inside the weight root, listed once so checking
+        each spec's local path doesn't need a separate stat
+        """
+        try:
+            with os.scandir(self._weight_root) as entries:
+                return frozenset(entry.name for entry in entries if entry.is_dir())
+        except OSError:
+            return frozenset()
+
     def _get_hf_path(self, spec: EngineSpec, local_only=True):
         extra_kwargs = {}
 
@@ -722,7 +1387,8 @@ class EngineManager(object):
             elif isinstance(patterns, str):
                 return [patterns]
             else:
-                return patterns
+                # Copy, as we extend these below and mustn't change the spec
+                return list(patterns)
 
         ignore_patterns = build_patterns(spec.ignore_patterns)
         allow_patterns = build_patterns(spec.allow_patterns)
@@ -766,20 +1432,16 @@ class EngineManager(object):
                 # Read out the list of files
                 repo_files = [f.rfilename for f in repo_info.siblings]
                 # Filter by any ignore / allow
-                repo_files = huggingface_hub.utils.filter_repo_objects(
+                repo_files = filter_paths(
                     repo_files,
+                    allow_patterns=allow_patterns,
                     ignore_patterns=ignore_patterns,
-                    allow_patterns=allow_patterns if allow_patterns else None,
                 )
-                # Split into path and extension tuple
-                repo_files = [os.path.splitext(f) for f in repo_files]
-                # Sort by extension (grouping fails if not correctly sorted)
-                repo_files.sort(key=lambda x: x[1])
-                # Turn into a dictionary of { extension: set_of_files }
-                grouped = {
-                    k: {f[0] for f in v}
-                    for k, v in itertools.groupby(repo_files, lambda x: x[1])
-                }
+                # Turn into a dictionary of { extension: set_of_files } in one pass
+                grouped: dict[str, set[str]] = {}
+                for f in repo_files:
+                    path, ext = os.path.splitext(f)
+                    grouped.setdefault(ext, set()).add(path)
 
                 has_ckpt = ".ckpt" in grouped
                 has_bin = ".bin" in grouped
@@ -789,8 +1451,6 @@ class EngineManager(object):
                 # Now decide which we will use
                 use = None
 
-                extensions = {"ckpt", "bin", "pt", "safetensors", "msgpack", "h5"}
-
                 if spec.safe_only:
                     use = "safetensors"
                 elif has_bin:
@@ -798,10 +1458,11 @@ class EngineManager(object):
                         use = "safetensors"
                         if has_ckpt:
                             # Explictly don't include any safetensors that match ckpt files
-                            ignore_patterns += [
-                                "{file}.safetensors"
+                            # (grouped paths already include any subfolder)
+                            ignore_patterns.extend(
+                                f"{glob.escape(file)}.safetensors"
                                 for file in (grouped[".ckpt"] & grouped[".safetensors"])
-                            ]
+                            )
                     else:
                         use = "bin"
                 elif has_safe:
@@ -815,11 +1476,11 @@ class EngineManager(object):
                         "Repo {model_path} doesn't appear to contain any model files."
                     )
 
-                ignore_patterns += [
+                ignore_patterns.extend(
                     f"{subfolder}*.{extension}"
-                    for extension in extensions
+                    for extension in WEIGHT_EXTENSIONS
                     if extension != use
-                ]
+                )
 
                 if ignore_patterns:
                     extra_kwargs["ignore_patterns"] = ignore_patterns
@@ -871,15 +1532,13 @@ class EngineManager(object):
             raise ValueError("No remote model name was provided")
 
         try:
+            # Scan once, and use the same scan to delete the revisions
+            cache_info = huggingface_hub.scan_cache_dir()
             repo_info = next(
-                (
-                    repo
-                    for repo in huggingface_hub.scan_cache_dir().repos
-                    if repo.repo_id == model_path
-                )
+                (repo for repo in cache_info.repos if repo.repo_id == model_path)
             )
             hashes = [revision.commit_hash for revision in repo_info.revisions]
-            huggingface_hub.scan_cache_dir().delete_revisions(*hashes).execute()
+            cache_info.delete_revisions(*hashes).execute()
         except:
             pass
 
@@ -893,67 +1552,89 @@ class EngineManager(object):
 
         if isinstance(urls, str):
             id = hashlib.sha1(urls.encode("utf-8")).hexdigest()
-            _, filename = os.path.split(urlparse(urls).path)
+            # URL paths always use "/", whatever the local path separator is
+            filename = urlparse(urls).path.rsplit("/", 1)[-1]
             urls = {filename: urls}
         else:
             id = urls["id"]
             urls = {k: v for k, v in urls.items() if k != "id"}
 
         cache_path = os.path.join(sd_cache_home, id)
-        temp_path = os.path.join(sd_cache_home, "temp")
+        temp_path = DOWNLOAD_TEMP_PATH
 
-        if os.path.isdir(cache_path):
-            exists = {
-                name: os.path.isfile(os.path.join(cache_path, name))
+        # List the cache directory once, rather than a stat per file. Only names
+        # not found directly in it (e.g. in a subdirectory) need checking further
+        try:
+            with os.scandir(cache_path) as it:
+                present = {entry.name for entry in it if entry.is_file()}
+        except (FileNotFoundError, NotADirectoryError):
+            present = None
+
+        if present is not None:
+            missing = [
+                name
                 for name in urls.keys()
-            }
-            if all(exists.values()):
+                if name not in present
+                and not os.path.isfile(os.path.join(cache_path, name))
+            ]
+            if not missing:
                 return cache_path
             elif local_only:
-                raise ValueError(
-                    f"Items missing from cache: {[name for name, exist in exists.items() if not exist]}"
-                )
+                raise ValueError(f"Items missing from cache: {missing}")
         elif local_only:
             raise ValueError("No local cache for URL")
 
         os.makedirs(cache_path, exist_ok=True)
         os.makedirs(temp_path, exist_ok=True)
 
-        for name, url in urls.items():
-            full_name = os.path.join(cache_path, name)
-            if os.path.exists(full_name):
-                continue
-
-            temp_name = None
-            with tempfile.NamedTemporaryFile(
-                mode="wb", dir=temp_path, delete=False
-            ) as temp_file:
-                http_get(url, temp_file)
-                temp_name = temp_file.name
+        pending = [
+            (url, os.path.join(cache_path, name), temp_path)
+            for name, url in urls.items()
+            if present is None or name in missing
+        ]
 
-            if temp_name:
-                os.replace(temp_name, full_name)
+        # Download any missing files concurrently, splitting the connection
+        # budget between them so a host never sees more than that at once
+        if pending:
+            workers = min(DOWNLOAD_CONNECTIONS, len(pending))
+            parts = DOWNLOAD_CONNECTIONS // workers
+
+            with ThreadPoolExecutor(workers) as executor:
+                # Consume the results so any exception gets raised
+                list(
+                    executor.map(
+                        lambda args: self._download_url(*args, parts=parts), pending
+                    )
+                )
 
         return cache_path
 
+    def _download_url(self, url, full_name, temp_path, parts=DOWNLOAD_CONNECTIONS):
+        temp_name = None
+        with tempfile.NamedTemporaryFile(
+            mode="wb", buffering=DOWNLOAD_CHUNK_SIZE, dir=temp_path, delete=False
+        ) as temp_file:
+            parallel_http_get(url, temp_file, parts=parts)
+            temp_name = temp_file.name
+
+        if temp_name:
+            os.replace(temp_name, full_name)
+
+    def _matches_refresh(self, spec: EngineSpec) -> bool:
+        model_path = spec.model
+        return bool(
+            self._refresh_regex
+            and isinstance(model_path, str)
+            and self._refresh_regex.match(model_path)
+        )
+
     def _get_weight_path_candidates(self, spec: EngineSpec):
         candidates = []
 
         def add_candidate(callable, *args, **kwargs):
             candidates.append((callable, args, kwargs))
 
-        model_path = spec.model
-        matches_refresh = (
-            self._refresh_models
-            and model_path
-            and any(
-                (
-                    True
-                    for pattern in self._refresh_models
-                    if fnmatch(model_path, pattern)
-                )
-            )
-        )
+        matches_refresh = self._matches_refresh(spec)
 
         # 1st: If this model should explicitly be refreshed, try refreshing from...
         if matches_refresh:
@@ -982,48 +1663,11 @@ class EngineManager(object):
         return candidates
 
     def _import_class(self, fqclass_name: str | tuple[str, str]):
-        # You can pass in either a (dot seperated) string or a tuple of library, class
-        if isinstance(fqclass_name, str):
-            *library_name, class_name = fqclass_name.split(".")
-            library_name = ".".join(library_name)
-        else:
-            library_name, class_name = fqclass_name
-
-        if not library_name:
-            library_name = DEFAULT_LIBRARIES.get(class_name, None)
-
-        if not library_name:
-            raise EnvironmentError(
-                f"Don't know the library name for class {class_name}"
-            )
-
-        # Is `library_name` a submodule of diffusers.pipelines?
-        is_pipeline_module = hasattr(pipelines, library_name)
-
-        if is_pipeline_module:
-            # If so, look it up from there
-            pipeline_module = getattr(pipelines, library_name)
-            class_obj = getattr(pipeline_module, class_name)
-        else:
-            # else we just import it from the library.
-            library = importlib.import_module(library_name)
-            class_obj = getattr(library, class_name, None)
-
-            # Backwards compatibility - if config asks for transformers.CLIPImageProcessor
-            # and we don't have it, use transformers.CLIPFeatureExtractor, that's the old name
-            if not class_obj:
-                if (
-                    library_name == "transformers"
-                    and class_name == "CLIPImageProcessor"
-                ):
-                    class_obj = getattr(library, "CLIPFeatureExtractor", None)
+        # Configs give the library and class as a list, which can't be cached on
+        if not isinstance(fqclass_name, str):
+            fqclass_name = tuple(fqclass_name)
 
-            if not class_obj:
-                raise EnvironmentError(
-                    f"Config attempts to import {library}.{class_name} that doesn't appear to exist"
-                )
-
-        return class_obj
+        return import_class(fqclass_name)
 
     def _load_model_from_weights(
         self,
@@ -1065,14 +1709,84 @@ class EngineManager(object):
         if os.path.isdir(sub_path):
             weight_path = sub_path
 
-        model = load_method(weight_path, **loading_kwargs)
+        model = None
+
+        if (
+            ckpt_utils.TORCH_SUPPORTS_MMAP
+            and self.mode.mmap_load
+            and (is_diffusers_model or is_transformers_model)
+        ):
+            model = self._load_model_mmap(
+                class_obj, weight_path, loading_kwargs.get("torch_dtype")
+            )
+
+        if model is None:
+            model = load_method(weight_path, **loading_kwargs)
+
         model._source = weight_path
         return model
 
+    def _load_model_mmap(self, class_obj, weight_path, dtype=None):
+        """
+        Load a model with pickled weights by memory-mapping the state dict and
+        assigning the mapped tensors straight into a meta-device skeleton, rather
+        than copying them into freshly allocated CPU tensors.
+
+        Returns None if the weights aren't suitable, so the caller can fall back
+        to the normal from_pretrained path.
+        """
+        try:
+            entries = set(os.listdir(weight_path))
+        except OSError:
+            return None
+
+        # Safetensors are already loaded without a copy by from_pretrained
+        if any(entry.endswith(".safetensors") for entry in entries):
+            return None
+
+        bin_name = next((n for n in PICKLED_WEIGHT_NAMES if n in entries), None)
+        if bin_name is None:
+            return None
+
+        if issubclass(class_obj, ModelMixin):
+            config = class_obj.load_config(weight_path)
+        else:
+            config = class_obj.config_class.from_pretrained(weight_path).to_dict()
+
+        # Skeletons are cached by config, so retrying the same model from another
+        # candidate path (or in another dtype) only repeats the fill below
+        skeleton = _meta_skeleton(
+            class_obj, json.dumps(config, sort_keys=True, default=str)
+        )
+        model = copy.deepcopy(skeleton)
+
+        advise_willneed(os.path.join(weight_path, bin_name))
+
+        state_dict = torch.load(
+            os.path.join(weight_path, bin_name),
+            map_location="cpu",
+            mmap=True,
+            weights_only=True,
+        )
+        model.load_state_dict(state_dict, assign=True, strict=False)
+
+        # Anything the state dict didn't cover (tied weights, non-persistent
+        # buffers) is still on the meta device, so this model isn't usable
+        if any(
+            tensor.is_meta
+            for tensor in itertools.chain(model.parameters(), model.buffers())
+        ):
+            return None
+
+        if dtype is not None:
+            model = model.to(dtype)
+
+        return model.eval()
+
     def _load_modelset_from_weights(
         self, weight_path, whitelist=None, blacklist=None, fp16=None
     ):
-        config_dict = DiffusionPipeline.load_config(weight_path, local_files_only=True)
+        config_dict = _cached_load_config(os.path.abspath(weight_path))
 
         if isinstance(whitelist, str):
             whitelist = [whitelist]
@@ -1113,34 +1827,133 @@ class EngineManager(object):
 
     # mix_* methods copied from https://github.com/huggingface/diffusers/blob/main/examples/community/checkpoint_merger.py
 
+    # These are written as single fused ops where possible (lerp is
+    # theta0 + (theta1 - theta0) * weight) to avoid full-size temporaries.
+    # lerp only handles floating point tensors, so others use the original form
+
     @staticmethod
     def mix_weighted_sum(alpha, theta0, theta1):
+        if theta0.is_floating_point() and theta0.dtype == theta1.dtype:
+            return torch.lerp(theta0, theta1, alpha)
         return ((1 - alpha) * theta0) + (alpha * theta1)
 
     # Smoothstep (https://en.wikipedia.org/wiki/Smoothstep)
     @staticmethod
     def mix_sigmoid(alpha, theta0, theta1):
-        alpha = alpha * alpha * (3 - (2 * alpha))
+        alpha = smoothstep(alpha)
+        if theta0.is_floating_point() and theta0.dtype == theta1.dtype:
+            return torch.lerp(theta0, theta1, alpha)
         return theta0 + ((theta1 - theta0) * alpha)
 
     # Inverse Smoothstep (https://en.wikipedia.org/wiki/Smoothstep)
     @staticmethod
     def mix_inv_sigmoid(alpha, theta0, theta1):
-        alpha = 0.5 - math.sin(math.asin(1.0 - 2.0 * alpha) / 3.0)
+        alpha = inv_smoothstep(alpha)
+        if theta0.is_floating_point() and theta0.dtype == theta1.dtype:
+            return torch.lerp(theta0, theta1, alpha)
         return theta0 + ((theta1 - theta0) * alpha)
 
     @staticmethod
     def mix_difference(alpha, theta0, theta1, theta2):
-        return theta0 + (theta1 - theta2) * (1.0 - alpha)
+        diff = theta1 - theta2
+        if diff.is_floating_point() and diff.dtype == theta0.dtype:
+            return diff.mul_(1.0 - alpha).add_(theta0)
+        return theta0 + diff * (1.0 - alpha)
+
+    def _foreach_mix(self, mix_method, alpha, tomix):
+        """
+        Mix lists of matching tensors (one list per model) using torch's fused
+        multi-tensor kernels, so each step is one dispatch for all the tensors
+        rather than one per tensor. Returns None if mix_method has no fused version.
+        """
+        if not hasattr(torch, "_foreach_lerp_"):
+            return None
+
+        cls = self.__class__
+
+        if mix_method is cls.mix_difference:
+            result = [tensor.clone() for tensor in tomix[0]]
+            diffs = torch._foreach_sub(tomix[1], tomix[2])
+            torch._foreach_add_(result, diffs, alpha=1.0 - alpha)
+            return result
 
-    def _mix_models(self, mix_method, models, alpha):
+        # The other methods are all linear interpolations from theta0 to theta1
+        lerp_weights = {
+            cls.mix_weighted_sum: lambda a: a,
+            cls.mix_sigmoid: smoothstep,
+            cls.mix_inv_sigmoid: inv_smoothstep,
+        }
+
+        if (lerp_weight := lerp_weights.get(mix_method)) is None:
+            return None
+
+        result = [tensor.clone() for tensor in tomix[0]]
+        torch._foreach_lerp_(result, tomix[1], lerp_weight(alpha))
+        return result
+
+    def _mix_models(self, mix_method, models, alpha, fused_batch_size=64):
+        # state_dict only holds references to the existing tensors, not copies
         thetas = [model.state_dict() for model in models]
-        result = {}
+
+        # Start with a clone that shares the first model's tensors, and swap
+        # each mixed tensor into it as it's produced, so there's never more
+        # than one extra copy of the weights
+        mixed_model = clone_model(models[0])
+
+        # Mixing is memory bandwidth bound, so if there's a GPU do it there,
+        # copying each batch up on a side stream while the previous one mixes
+        gpu = torch.device("cuda") if self.mode.device == "cuda" else None
+        copy_stream = self._stream_pool.get(gpu) if gpu else None
+        pin = self.mode.pin_memory
+
+        # Tied or aliased tensors appear under several keys. Only mix the first
+        # key, and point the rest at its result so they stay shared
+        first_keys = {}
+        aliases = {}
+        for key, tensor in thetas[0].items():
+            ident = (tensor.data_ptr(), tensor.shape, tensor.stride(), tensor.dtype)
+            if ident in first_keys:
+                aliases[key] = first_keys[ident]
+            else:
+                first_keys[ident] = key
+
+        stored = {}
+
+        def store(key, mix):
+            original = thetas[0][key]
+
+            # With pinning enabled, results headed for the CPU go straight into
+            # pinned memory, so the mixed model can later be copied to the GPU
+            # asynchronously
+            if gpu is not None and pin and original.device.type == "cpu":
+                out = torch.empty(original.shape, dtype=original.dtype, pin_memory=True)
+                out.copy_(mix, non_blocking=True)
+                mix = out
+            else:
+                mix = mix.to(original.device, original.dtype)
+
+            set_module_tensor_to_device(mixed_model, key, mix.device, value=mix)
+            stored[key] = mix
+
+        # Floating point tensors whose shape and dtype match across every model,
+        # which can all be mixed together in one go
+        fused_keys = []
 
         for key in thetas[0].keys():
+            if key in aliases:
+                continue
+
             tomix = [theta[key] for theta in thetas]
             shapes = [tensor.shape for tensor in tomix]
 
+            if (
+                all_same(shapes)
+                and all_same(tensor.dtype for tensor in tomix)
+                and tomix[0].is_floating_point()
+            ):
+                fused_keys.append(key)
+                continue
+
             neqidx = [i for i, (u, v) in enumerate(zip(shapes[0], shapes[1])) if u != v]
 
             # If all the shapes match, easy to mix them
@@ -1163,10 +1976,63 @@ class EngineManager(object):
                     f"Shapes were {shapes}"
                 )
 
-            result[key] = mix
+            store(key, mix)
+
+        def fetch(keys):
+            tomix = [[theta[key] for key in keys] for theta in thetas]
+            if gpu is None:
+                return tomix, None
+
+            with torch.cuda.stream(copy_stream):
+                tomix = [
+                    [tensor.to(gpu, non_blocking=True) for tensor in tensors]
+                    for tensors in tomix
+                ]
+                return tomix, copy_stream.record_event()
+
+        # Mix in batches, to bound the temporaries the fused kernels allocate
+        batches = [
+            fused_keys[i : i + fused_batch_size]
+            for i in range(0, len(fused_keys), fused_batch_size)
+        ]
+        fetched = fetch(batches[0]) if batches else None
+
+        for i, keys in enumerate(batches):
+            tomix, ready = fetched
+            fetched = fetch(batches[i + 1]) if i + 1 < len(batches) else None
+
+            if ready is not None:
+                compute_stream = torch.cuda.current_stream(gpu)
+                compute_stream.wait_event(ready)
+                # Tell the allocator these are in use on this stream too
+                for tensors in tomix:
+                    for tensor in tensors:
+                        tensor.record_stream(compute_stream)
+
+            mixes = self._foreach_mix(mix_method, alpha, tomix)
+            if mixes is None:
+                mixes = [mix_method(alpha, *tensors) for tensors in zip(*tomix)]
+
+            for key, mix in zip(keys, mixes):
+                store(key, mix)
+
+            del tomix, mixes
+
+        for key, source in aliases.items():
+            mix = stored[source]
+            set_module_tensor_to_device(mixed_model, key, mix.device, value=mix)
+
+        # Drop the references to the source models' tensors. Cleared rather
+        # than deleted, as store and fetch close over it
+        thetas.clear()
+
+        if gpu is not None:
+            # Wait for any outstanding copies into pinned memory. Anything that
+            # wasn't mixed (like non-persistent buffers) is still shared with
+            # models[0], so is left as it is
+            torch.cuda.synchronize(gpu)
+            self._stream_pool.put(gpu, copy_stream)
 
-        mixed_model = clone_model(models[0], clone_tensors="cpu")
-        mixed_model.load_state_dict(result)
         mixed_model._source = "Mix " + ",".join(model._source for model in models)
         return mixed_model
 
@@ -1268,17 +2134,21 @@ class EngineManager(object):
         ignore_patterns=None,
         allow_patterns=None,
     ):
-        safetensor_paths = glob.glob("*.safetensors", root_dir=weight_path)
-        ckpt_paths = glob.glob("*.ckpt", root_dir=weight_path) + glob.glob(
-            "*.pt", root_dir=weight_path
-        )
-
-        safetensor_paths = list(
-            huggingface_hub.utils.filter_repo_objects(
-                safetensor_paths,
-                allow_patterns=allow_patterns,
-                ignore_patterns=ignore_patterns,
+        # One directory listing, skipping hidden files like glob does
+        with os.scandir(weight_path) as it:
+            entries = sorted(
+                entry.name
+                for entry in it
+                if entry.is_file() and not entry.name.startswith(".")
             )
+
+        safetensor_paths = [name for name in entries if name.endswith(".safetensors")]
+        ckpt_paths = [name for name in entries if name.endswith((".ckpt", ".pt"))]
+
+        safetensor_paths = filter_paths(
+            safetensor_paths,
+            allow_patterns=allow_patterns,
+            ignore_patterns=ignore_patterns,
         )
 
         if fp16 is None:
@@ -1288,8 +2158,10 @@ class EngineManager(object):
             whitelist=whitelist,
             blacklist=blacklist,
             dtype=torch.float16 if fp16 else None,
+            mmap=self.mode.mmap_load,
         )
 
+        # Prefer safetensors, which load without unpickling or copying
         if safetensor_paths:
             if len(safetensor_paths) > 1:
                 raise EnvironmentError(
@@ -1364,7 +2236,107 @@ class EngineManager(object):
 
         return models if isinstance(models, ModelSet) else ModelSet(**models)
 
+    @cached_property
+    def _candidate_cache(self) -> dict[str, dict]:
+        try:
+            with open(CANDIDATE_CACHE_PATH, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_candidate_cache(self):
+        temp_name = f"{CANDIDATE_CACHE_PATH}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(CANDIDATE_CACHE_PATH), exist_ok=True)
+            with open(temp_name, "w") as f:
+                json.dump(self._candidate_cache, f)
+            os.replace(temp_name, CANDIDATE_CACHE_PATH)
+        except OSError:
+            pass
+
+    def _candidate_cache_key(self, spec: EngineSpec) -> str:
+        # Any change to the spec or to how it would be resolved invalidates the entry
+        key = json.dumps(
+            [spec._data, self._weight_root, self.mode.fp16], sort_keys=True, default=str
+        )
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _weight_path_mtime(weight_path: str) -> int:
+        # A pipeline's model_index.json is rewritten whenever it's saved, which
+        # a directory's own mtime doesn't reflect
+        index_path = os.path.join(weight_path, "model_index.json")
+        if os.path.isfile(index_path):
+            return os.stat(index_path).st_mtime_ns
+        return os.stat(weight_path).st_mtime_ns
+
+    def _first_local_candidate(self, spec: EngineSpec) -> str | None:
+        """
+        The path the first candidate that doesn't need the network resolves to.
+        This is where an uncached load would come from, if it loads.
+        """
+        for callback, args, kwargs in self._get_weight_path_candidates(spec):
+            if callback != self._get_local_path and not kwargs.get("local_only"):
+                continue
+            try:
+                return callback(spec, *args, **kwargs)
+            except (ValueError, OSError):
+                pass
+
+        return None
+
+    def _get_cached_candidate(self, spec: EngineSpec) -> str | None:
+        # Models being refreshed must go through the candidates in order
+        if self._matches_refresh(spec):
+            return None
+
+        key = self._candidate_cache_key(spec)
+        entry = self._candidate_cache.get(key)
+        if entry is None:
+            return None
+
+        # Only trust the entry if nothing with higher priority has turned up
+        # since (like a newly saved local model, or a newer hub snapshot)
+        try:
+            if (
+                entry["path"] == self._first_local_candidate(spec)
+                and self._weight_path_mtime(entry["path"]) == entry["mtime"]
+            ):
+                return entry["path"]
+        except (OSError, KeyError, TypeError):
+            pass
+
+        self._set_cached_candidate(spec, None)
+        return None
+
+    def _set_cached_candidate(self, spec: EngineSpec, weight_path: str | None):
+        key = self._candidate_cache_key(spec)
+
+        if weight_path is None:
+            if self._candidate_cache.pop(key, None) is None:
+                return
+        else:
+            try:
+                mtime = self._weight_path_mtime(weight_path)
+            except OSError:
+                return
+
+            entry = {"path": weight_path, "mtime": mtime}
+            if self._candidate_cache.get(key) == entry:
+                return
+            self._candidate_cache[key] = entry
+
+        self._save_candidate_cache()
+
     def _load_from_weight_candidates(self, spec: EngineSpec) -> tuple[ModelSet, str]:
+        # If the highest priority local candidate is where this spec last loaded
+        # from successfully, load it straight away
+        if cached_path := self._get_cached_candidate(spec):
+            try:
+                return self._load_from_weights(spec, cached_path), cached_path
+            except Exception:
+                self._set_cached_candidate(spec, None)
+
         candidates = self._get_weight_path_candidates(spec)
 
         failures = []
@@ -1374,6 +2346,7 @@ class EngineManager(object):
             try:
                 weight_path = callback(spec, *args, **kwargs)
                 models = self._load_from_weights(spec, weight_path)
+                self._set_cached_candidate(spec, weight_path)
                 return models, weight_path
             except ValueError as e:
                 if str(e) not in failures:
@@ -1478,18 +2451,7 @@ class EngineManager(object):
 
         available = set(model.keys())
 
-        class_init_params = inspect.signature(class_obj.__init__).parameters
-        expected = set(class_init_params.keys()) - set(["self"])
-
-        required = set(
-            [
-                name
-                for name, param in class_init_params.items()
-                if param.default is inspect._empty
-                and name != "self"
-                and name != "safety_checker"
-            ]
-        )
+        expected, required = _sig_params(class_obj)
 
         if required - available:
             raise EnvironmentError(
@@ -1531,7 +2493,12 @@ class EngineManager(object):
         else:
             wrap_class = PipelineWrapper
 
-        return wrap_class(id=spec.id, mode=self._mode, pipeline=pipeline)
+        return wrap_class(
+            id=spec.id,
+            mode=self._mode,
+            pipeline=pipeline,
+            stream_pool=self._stream_pool,
+        )
 
     def loadPipelines(self):
 
@@ -1552,9 +2519,44 @@ class EngineManager(object):
             print(f"  - Engine {engineid}...")
             self._engine_models[engineid] = self._load_model(engine)
 
+        self._resolve_engine.cache_clear()
+
+        self._prewarm_pipelines()
+
+        if self._idle_ttl and self._janitor is None:
+            self._janitor = threading.Thread(
+                target=self._janitor_loop, name="pipeline-janitor", daemon=True
+            )
+            self._janitor.start()
+
         if self.batchMode.autodetect:
             self.batchMode.run_autodetect(self)
 
+    def _prewarm_pipelines(self):
+        # Build a pipeline for each engine that asks for it and put it in the pool
+        # (without activating it) so the first request doesn't pay the build cost
+        specs = [
+            spec
+            for spec in self.engines
+            if spec.enabled
+            and spec.is_engine
+            and spec.prewarm
+            and spec.id in self._engine_models
+        ]
+
+        if not specs:
+            return
+
+        print("Prewarming pipelines...")
+
+        def prewarm(spec):
+            print(f"  - Engine {spec.id}...")
+            self._add_pipeline_to_pool(self._build_pipeline_for_engine(spec))
+
+        with ThreadPoolExecutor(max(1, torch.cuda.device_count())) as executor:
+            # Consume the results so any exception gets raised
+            list(executor.map(prewarm, specs))
+
     def _fixcfg(self, model, key, test, value):
         if hasattr(model.config, key) and test(getattr(model.config, key)):
             print("Fixing", model._source)
@@ -1614,6 +2616,11 @@ class EngineManager(object):
             model = list(models.values())[0]
             model.save_pretrained(save_directory=outpath, safe_serialization=True)
 
+        # Configs under outpath may have just been overwritten, and the spec
+        # should now load from outpath rather than wherever it last came from
+        _cached_load_config.cache_clear()
+        self._set_cached_candidate(spec, None)
+
     def _find_specs(
         self,
         id: str | Iterable[str] | None = None,
@@ -1629,11 +2636,23 @@ class EngineManager(object):
         assert val
         val = (val,) if isinstance(val, str) else val
 
+        val = tuple(val)
+
+        # Exact names can be looked up directly
+        if not any(c in pattern for pattern in val for c in "*?["):
+            index = self._engine_index[key]
+            matches = sorted(
+                (match for name in set(val) for match in index.get(name, ())),
+                key=lambda match: match[0],
+            )
+            return (spec for _, spec in matches)
+
+        pattern = _compile_globs(val)
+
         return (
             spec
             for spec in self.engines
-            if key in spec
-            and any((True for pattern in val if fnmatch(spec.get(key), pattern)))
+            if key in spec and pattern.match(spec.get(key))
         )
 
     def _find_spec(
@@ -1712,23 +2731,17 @@ class EngineManager(object):
             if engine.enabled and engine.is_engine
         }
 
-    def _return_pipeline_to_pool(self, slot):
-        assert slot.pipeline, "No pipeline to return to pool"
-
-        # Get the current slot pipeline
-        pipeline = slot.pipeline
-
-        # Deactivate and remove it from the slot
-        slot.pipeline.deactivate()
-        slot.pipeline = None
-
-        # Return it to the pool (creating a pool if needed)
+    def _add_pipeline_to_pool(self, pipeline):
+        # Creating a pool if needed
         pool = self._available_pipelines.setdefault(pipeline.id, Queue())
         pool.put(pipeline)
 
-    def _get_pipeline_from_pool(self, slot, id):
-        assert not slot.pipeline, "Cannot allocate pipeline to full device slot"
+    def _return_pipeline_to_pool(self, pipeline):
+        # Deactivate the pipeline and return it to the pool
+        pipeline.deactivate()
+        self._add_pipeline_to_pool(pipeline)
 
+    def _get_pipeline_from_pool(self, id):
         # Get the pool. If none available, return
         pool = self._available_pipelines.get(id)
         if not pool:
@@ -1736,72 +2749,170 @@ class EngineManager(object):
 
         # Try getting a pipeline from the pool. Again, if none available, just return
         try:
-            pipeline = pool.get(block=False)
+            return pool.get(block=False)
         except queue.Empty:
             return None
 
-        # Assign the pipeline to the slot and activate
-        slot.pipeline = pipeline
-        slot.pipeline.activate(slot.device)
+    def _has_room(self, slot, pipeline):
+        if len(slot.active) >= slot.active.capacity:
+            return False
 
-        return pipeline
+        if slot.device.type != "cuda":
+            return True
 
-    @contextmanager
-    def with_engine(self, id=None, task=None):
+        # Memory the caching allocator is holding but not using is available too
+        free, _ = torch.cuda.mem_get_info(slot.device)
+        free += torch.cuda.memory_reserved(slot.device)
+        free -= torch.cuda.memory_allocated(slot.device)
+
+        return free >= pipeline.footprint
+
+    def _evict_victim(self, slot):
+        self._evict(slot, slot.active.pop_victim())
+
+    def _evict(self, slot, old):
+        self._return_pipeline_to_pool(old)
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "Existing pipeline %s deactivated. %s", old.id, self._ram_snapshot()
+            )
+
+    def _ram_snapshot(self):
+        return self._ram_monitor.snapshot() if self._ram_monitor else ""
+
+    def _janitor_loop(self):
+        # Check a few times per TTL, so pipelines don't outlive it by much
+        interval = min(30, self._idle_ttl / 2)
+
+        while True:
+            time.sleep(interval)
+            try:
+                self._evict_idle()
+            except Exception:
+                logger.exception("Error deactivating idle pipelines")
+
+    def _evict_idle(self):
         """
-        Get and activate a pipeline
-        TODO: Better activate / deactivate logic. Right now we just keep a max of one pipeline active.
+        Deactivate pipelines that haven't been used for idle_ttl seconds. Only
+        slots no request is holding are checked, the rest wait for next time
         """
+        slots = []
+        try:
+            while True:
+                slots.append(self._device_queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        try:
+            cutoff = time.monotonic() - self._idle_ttl
+            for slot in slots:
+                for id in slot.active.idle_since(cutoff):
+                    self._evict(slot, slot.active.pop(id))
+        finally:
+            # Put back in reverse, so the most recently used slot is still next
+            for slot in reversed(slots):
+                self._device_queue.put(slot)
+
+    def _make_room(self, slot, pipeline):
+        # Deactivate pipelines on the slot, as chosen by the eviction policy,
+        # until there's space for this one
+        while slot.active and not self._has_room(slot, pipeline):
+            self._evict_victim(slot)
+
+    def _activate_on_slot(self, slot, pipeline):
+        self._make_room(slot, pipeline)
+
+        # The footprint is only an estimate, so if activating still runs out
+        # of memory, deactivate more of the slot's pipelines and retry
+        while True:
+            try:
+                pipeline.activate(slot.device)
+                return
+            except Exception as e:
+                # Release whatever was copied to the device before the failure
+                if pipeline.is_active:
+                    pipeline.deactivate()
+
+                if not (is_out_of_memory(e) and slot.active):
+                    raise
+
+                self._evict_victim(slot)
 
+    def _resolve_engine(self, id, task):
+        """
+        Find the spec for an engine id (or the default for task if id is None).
+        Cached per instance in __init__, and cleared when defaults change.
+        """
         if id is None:
-            id = self._defaults[task if task else "generate"]
+            id = self._defaults.get(task or "generate")
 
         if id is None:
             raise EngineNotFoundError("No engine ID provided and no default is set.")
 
         # Get the engine spec
-        spec = self._find_spec(id=id)
+        spec = self._spec_by_id.get(id)
         if not spec or not spec.enabled:
             raise EngineNotFoundError(f"Engine ID {id} doesn't exist or isn't enabled.")
 
         if task is not None and task != spec.task:
             raise ValueError(f"Engine ID {id} is for task '{spec.task}' not '{task}'")
 
-        # Get device queue slot
-        slot = self._device_queue.get()
-
-        # Get pipeline (create if all pipelines for the id are busy)
+        return spec
 
-        # If a pipeline is already active on this device slot, check if it's the right
-        # one. If not, deactivate it and clear it
-        if slot.pipeline and slot.pipeline.id != id:
-            old_id = slot.pipeline.id
-            self._return_pipeline_to_pool(slot)
-
-            if self._ram_monitor:
-                print(f"Existing pipeline {old_id} deactivated")
-                self._ram_monitor.print()
-
-        # If there's no pipeline on this device slot yet, find it (creating it
-        # if all the existing pipelines are busy)
-        if not slot.pipeline:
-            existing = True
-            self._get_pipeline_from_pool(slot, id)
-
-            if not slot.pipeline:
-                existing = False
-                slot.pipeline = self._build_pipeline_for_engine(spec)
-                slot.pipeline.activate(slot.device)
-
-            if self._ram_monitor:
-                print(f"{'Existing' if existing else 'New'} pipeline {id} activated")
-                self._ram_monitor.print()
+    def _acquire_and_activate(self, spec, slot):
+        """
+        Get a pipeline for spec that is active on a device slot, returning
+        (pipeline, slot, existing). The slot might not be the one passed in,
+        and existing is None if the pipeline was already active on it. If this
+        raises, the slot has already been released.
+        """
+        id = spec.id
+        pipeline = None
 
         try:
-            # Do the work
-            yield slot.pipeline
-        finally:
-            # Release device handle
-            self._device_queue.put(slot)
+            # Use the pipeline if it's already active on this device slot
+            active = slot.active.get(id)
+            if active is not None:
+                return active, slot, None
+
+            # If not, find it (creating it if all the existing pipelines are busy)
+            pipeline = self._get_pipeline_from_pool(id)
+            existing = pipeline is not None
+
+            if pipeline is None:
+                # Building is slow but doesn't need the device, so let other
+                # requests have the slot in the meantime
+                self._device_queue.put(slot)
+                slot = None
+
+                pipeline = self._build_pipeline_for_engine(spec)
+                slot = self._device_queue.get(id)
+
+                # The slot we get back might already have this engine active
+                if id in slot.active:
+                    self._add_pipeline_to_pool(pipeline)
+                    return slot.active.get(id), slot, None
+
+            # Activate it, deactivating others if needed to make room
+            self._activate_on_slot(slot, pipeline)
+            slot.active[id] = pipeline
+            return pipeline, slot, existing
+
+        except BaseException:
+            # A failed activation leaves the pipeline inactive, so it can go
+            # straight back in the pool
+            if pipeline is not None and id not in getattr(slot, "active", ()):
+                self._add_pipeline_to_pool(pipeline)
+            if slot is not None:
+                self._device_queue.put(slot)
+            raise
+
+    def with_engine(self, id=None, task=None):
+        """
+        Get and activate a pipeline. Each device slot keeps up to
+        max_active_pipelines pipelines active, deactivating one (chosen by
+        the eviction policy) when it needs space for another.
+        """
 
-        # All done
+        return EngineSession(self, self._resolve_engine(id, task))
@@ -1,3 +1,4 @@
+import itertools
 from copy import deepcopy
 from typing import Literal
 
@@ -82,10 +83,30 @@ class GPUExclusionSet:
         self.reset(exclude=self.activated)
 
 
+def pin_model(model):
+    """
+    Copies a CPU model's parameters and buffers into newly allocated pinned
+    (page-locked) memory, so copies to CUDA can be done asynchronously. Each
+    tensor's .data is reassigned to the pinned copy, so any clones sharing the
+    tensor objects see it too. This needs a second host copy of each tensor
+    while it's being pinned, and replaces any memory-mapped storage.
+    """
+    if not isinstance(model, torch.nn.Module) or getattr(model, "_pinned", False):
+        return model
+
+    for tensor in itertools.chain(model.parameters(), model.buffers()):
+        if tensor.device.type == "cpu" and not tensor.is_pinned():
+            tensor.data = tensor.data.pin_memory()
+
+    model._pinned = True
+    return model
+
+
 def clone_model(
     model,
     clone_tensors: Literal["share"] | str | torch.device = "share",
     exclusion_set=None,
+    non_blocking=False,
 ):
     """
     Copies a model so you get a different set of instances, but they share
@@ -99,44 +120,24 @@ def clone_model(
             clone = clone.to(clone_tensors)
         return clone
 
-    # Start by pulling all the Tensors out of the model, so they're not copied on deepclone
+    # Collect all the Tensors in the model
     cache = {}
 
     for (model_name, source) in model.named_modules():
-        model_params = {}
-        model_buffers = {}
-
-        for name, param in source.named_parameters(recurse=False):
-            model_params[name] = param
-            source._parameters[name] = None
-
-        for name, buffer in source.named_buffers(recurse=False):
-            model_buffers[name] = buffer
-            source._buffers[name] = None
-
-        cache[model_name] = (model_params, model_buffers)
-
-    # Deep clone the model
-    clone = deepcopy(model)
-
-    # Put the tensors back into the model
-    for (model_name, dest) in model.named_modules():
-        model_params, model_buffers = cache[model_name]
-
-        for name, param in model_params.items():
-            dest._parameters[name] = param
-        for name, buffer in model_buffers.items():
-            dest._buffers[name] = buffer
+        cache[model_name] = (
+            dict(source.named_parameters(recurse=False)),
+            dict(source.named_buffers(recurse=False)),
+        )
 
-    # And into the clone
-    # Even if we're not sharing, set it to shared to start with
-    for (model_name, dest) in clone.named_modules():
-        model_params, model_buffers = cache[model_name]
+    # Deep clone the model, pre-seeding the memo with the Tensors so deepcopy
+    # reuses them as-is. Even if we're not sharing, start off shared.
+    memo = {
+        id(tensor): tensor
+        for model_params, model_buffers in cache.values()
+        for tensor in itertools.chain(model_params.values(), model_buffers.values())
+    }
 
-        for name, param in model_params.items():
-            dest.register_parameter(name, param)
-        for name, buffer in model_buffers.items():
-            dest.register_buffer(name, buffer)
+    clone = deepcopy(model, memo)
 
     if clone_tensors != "share":
         if exclusion_set:
@@ -159,10 +160,14 @@ def clone_model(
                 )
             else:
                 for name, param in model_params.items():
-                    new_param = param.to(clone_tensors, copy=True)
+                    new_param = param.to(
+                        clone_tensors, copy=True, non_blocking=non_blocking
+                    )
                     set_module_tensor_to_device(dest, name, clone_tensors, new_param)
                 for name, buffer in model_buffers.items():
-                    new_buffer = buffer.to(clone_tensors, copy=True)
+                    new_buffer = buffer.to(
+                        clone_tensors, copy=True, non_blocking=non_blocking
+                    )
                     set_module_tensor_to_device(dest, name, clone_tensors, new_buffer)
 
     return clone
@@ -0,0 +1,259 @@
+import itertools
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from gyre.manager import DeviceQueueSlot, PipelineWrapper
+
+
+class EvictionPolicy:
+    """
+    Decides which of a device slot's active pipelines to deactivate when
+    it needs room for another
+    """
+
+    def insert(self, id, cost):
+        """A pipeline was activated. cost is how expensive it is to reactivate"""
+        raise NotImplementedError()
+
+    def touch(self, id):
+        """An active pipeline was used again"""
+        raise NotImplementedError()
+
+    def remove(self, id):
+        """A pipeline was deactivated"""
+        raise NotImplementedError()
+
+    def victim(self):
+        """The id of the pipeline to deactivate next"""
+        raise NotImplementedError()
+
+
+class LRUPolicy(EvictionPolicy):
+    """Deactivate the least recently used pipeline"""
+
+    def __init__(self):
+        self._order: OrderedDict[str, None] = OrderedDict()
+
+    def insert(self, id, cost):
+        self._order[id] = None
+        self._order.move_to_end(id)
+
+    def touch(self, id):
+        self._order.move_to_end(id)
+
+    def remove(self, id):
+        del self._order[id]
+
+    def victim(self):
+        return next(iter(self._order))
+
+
+class TwoQueuePolicy(EvictionPolicy):
+    """
+    2Q: pipelines start on probation and are only promoted to the main LRU
+    queue once reused, so a one-off request doesn't push out pipelines that
+    are used regularly. Recently evicted probationers are remembered, and go
+    straight to the main queue if they come back.
+    """
+
+    def __init__(self, ghost_size=16):
+        self._probation: OrderedDict[str, None] = OrderedDict()
+        self._main: OrderedDict[str, None] = OrderedDict()
+        self._ghosts: OrderedDict[str, None] = OrderedDict()
+        self._ghost_size = ghost_size
+
+    def insert(self, id, cost):
+        if id in self._ghosts:
+            del self._ghosts[id]
+            self._main[id] = None
+        else:
+            self._probation[id] = None
+
+    def touch(self, id):
+        if id in self._probation:
+            del self._probation[id]
+            self._main[id] = None
+        self._main.move_to_end(id)
+
+    def remove(self, id):
+        if id in self._probation:
+            del self._probation[id]
+            self._ghosts[id] = None
+            if len(self._ghosts) > self._ghost_size:
+                self._ghosts.popitem(last=False)
+        else:
+            del self._main[id]
+
+    def victim(self):
+        return next(iter(self._probation or self._main))
+
+
+class CostPolicy(EvictionPolicy):
+    """
+    Deactivate the pipeline that is cheapest to bring back relative to how long
+    it has been idle, so large pipelines stay active longer than small ones
+    used as often
+    """
+
+    def __init__(self):
+        self._costs: dict[str, float] = {}
+        self._last_used: dict[str, float] = {}
+
+    def insert(self, id, cost):
+        self._costs[id] = cost
+        self._last_used[id] = time.monotonic()
+
+    def touch(self, id):
+        self._last_used[id] = time.monotonic()
+
+    def remove(self, id):
+        del self._costs[id]
+        del self._last_used[id]
+
+    def victim(self):
+        now = time.monotonic()
+        return min(
+            self._costs,
+            key=lambda id: self._costs[id] / max(now - self._last_used[id], 1e-3),
+        )
+
+
+EVICTION_POLICIES = {
+    "lru": LRUPolicy,
+    "2q": TwoQueuePolicy,
+    "cost": CostPolicy,
+}
+
+
+class ActivePipelines:
+    """
+    The pipelines currently activated on a device, keyed by engine id, with
+    an EvictionPolicy choosing which to deactivate when out of room
+    """
+
+    def __init__(self, capacity=1, policy: EvictionPolicy | None = None):
+        self.capacity = capacity
+        self.policy = policy if policy is not None else LRUPolicy()
+        self._pipelines: dict[str, "PipelineWrapper"] = {}
+        # When each pipeline was last released, from time.monotonic(), oldest
+        # first so idle sweeps can stop at the first recent one
+        self._last_used: OrderedDict[str, float] = OrderedDict()
+
+    def get(self, id):
+        pipeline = self._pipelines.get(id)
+        if pipeline is not None:
+            self.policy.touch(id)
+        return pipeline
+
+    def __setitem__(self, id, pipeline):
+        if id in self._pipelines:
+            self.pop(id)
+        self._pipelines[id] = pipeline
+        self.policy.insert(id, pipeline.footprint)
+        self.touch(id)
+
+    def touch(self, id):
+        self._last_used[id] = time.monotonic()
+        self._last_used.move_to_end(id)
+
+    def __contains__(self, id):
+        return id in self._pipelines
+
+    def __len__(self):
+        return len(self._pipelines)
+
+    def __iter__(self):
+        return iter(self._pipelines.values())
+
+    def pop(self, id):
+        self.policy.remove(id)
+        self._last_used.pop(id, None)
+        return self._pipelines.pop(id)
+
+    def pop_victim(self):
+        return self.pop(self.policy.victim())
+
+    def idle_since(self, cutoff):
+        """The ids of pipelines that haven't been used since cutoff"""
+        return list(
+            itertools.takewhile(
+                lambda id: self._last_used[id] < cutoff, self._last_used
+            )
+        )
+
+
+class DeviceSlotQueue:
+    """
+    The device slots not currently in use by a request. Requests wait in
+    arrival order, except that a request for an engine already active on a
+    free slot can go first, so bursts of requests for the same engine don't
+    have to wait for other engines to be activated in between. max_burst
+    limits how many times in a row a slot can be taken out of order.
+    """
+
+    def __init__(self, max_burst=8):
+        self.max_burst = max_burst
+        self._cond = threading.Condition()
+        # Free slots, most recently released last
+        self._free: list["DeviceQueueSlot"] = []
+        # Waiting requests, oldest first, as (ticket, engine id)
+        self._waiting: list[tuple[object, str | None]] = []
+        # How many times in a row each slot has been taken out of order
+        self._bursts: dict[int, int] = {}
+
+    def put(self, slot):
+        with self._cond:
+            self._free.append(slot)
+            self._cond.notify_all()
+
+    def get_nowait(self):
+        with self._cond:
+            if not self._free:
+                raise queue.Empty()
+            return self._free.pop()
+
+    def get(self, engine_id=None):
+        with self._cond:
+            ticket = object()
+            self._waiting.append((ticket, engine_id))
+
+            try:
+                while (slot := self._pick(ticket, engine_id)) is None:
+                    self._cond.wait()
+                self._free.remove(slot)
+            finally:
+                self._waiting.remove((ticket, engine_id))
+                # Whoever is now oldest might be able to take a remaining slot
+                if self._free:
+                    self._cond.notify_all()
+
+            return slot
+
+    def _pick(self, ticket, engine_id):
+        # Prefer the most recently released slot with this engine active
+        for slot in reversed(self._free):
+            if engine_id is not None and engine_id in slot.active:
+                break
+        else:
+            slot = self._free[-1] if self._free else None
+
+        if slot is None:
+            return None
+
+        # The oldest request can always take a slot
+        if self._waiting[0][0] is ticket:
+            self._bursts[id(slot)] = 0
+            return slot
+
+        # Others only if the engine is already active and the burst isn't over
+        bursts = self._bursts.get(id(slot), 0)
+        if engine_id is not None and engine_id in slot.active:
+            if bursts < self.max_burst:
+                self._bursts[id(slot)] = bursts + 1
+                return slot
+
+        return None
@@ -61,14 +61,18 @@ class RamMonitor(threading.Thread):
         print("Stopped recording.")
         pynvml.nvmlShutdown()
 
-    def print(self):
-        # Wait for the update loop to run at least once
-        self.loop_lock.acquire(timeout=0.5)
-        print(
+    def snapshot(self):
+        # The latest sample from the update loop, without waiting for a new one
+        return (
             f"Current RAM: {mb(self.ram_current)}, VRAM: {mb(self.vram_current)} | "
             f"Peak RAM: {mb(self.ram_max_usage)}, VRAM: {mb(self.vram_max_usage)}"
         )
 
+    def print(self):
+        # Wait for the update loop to run at least once
+        self.loop_lock.acquire(timeout=0.5)
+        print(self.snapshot())
+
     def read(self):
         return dict(
             ram_max=self.ram_max_usage,
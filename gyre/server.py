@@ -1,5 +1,6 @@
 import argparse
 import hashlib
+import logging
 import os
 import re
 import secrets
@@ -12,6 +13,16 @@ import time
 import zipfile
 from concurrent import futures
 
+# Let huggingface_hub download with the Rust multi-connection hf_transfer if
+# it's installed. It reads this when first imported, so set it before anything
+# else can import it
+try:
+    import hf_transfer  # noqa: F401
+except ImportError:
+    pass
+else:
+    os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+
 import yaml
 
 from gyre.pipeline.xformers_utils import xformers_mea_available
@@ -471,6 +482,40 @@ def main():
     generation_opts.add_argument(
         "--enable_mps", action="store_true", help="Use MPS on MacOS where available"
     )
+    generation_opts.add_argument(
+        "--max_active_pipelines",
+        type=int,
+        default=os.environ.get("SD_MAX_ACTIVE_PIPELINES", 1),
+        help="How many pipelines to keep active on each GPU at once, if they fit in VRAM. More avoids reloading when switching between engines.",
+    )
+    generation_opts.add_argument(
+        "--eviction_policy",
+        type=str,
+        default=os.environ.get("SD_EVICTION_POLICY", "lru"),
+        choices=["lru", "2q", "cost"],
+        help="How to choose which active pipeline to deactivate when a GPU needs room for another. lru: least recently used. 2q: like lru, but pipelines only used once go first. cost: prefer ones that are quick to reactivate.",
+    )
+    generation_opts.add_argument(
+        "--pipeline_idle_ttl",
+        type=float,
+        default=os.environ.get("SD_PIPELINE_IDLE_TTL", None),
+        help="Deactivate pipelines that haven't been used for this many seconds, to free VRAM. Default is to keep them active until the space is needed.",
+    )
+    generation_opts.add_argument(
+        "--enable_fast_math",
+        action="store_true",
+        help="Use TF32 and cuDNN autotuning on CUDA. Faster on Ampere and later GPUs, but results for a given seed change slightly",
+    )
+    generation_opts.add_argument(
+        "--pin_memory",
+        action="store_true",
+        help="Keep model weights in page-locked RAM so activating them on a GPU is faster. Pinned RAM can't be swapped or reclaimed, so only use this with plenty of RAM to spare",
+    )
+    generation_opts.add_argument(
+        "--disable_mmap_load",
+        action="store_true",
+        help="Read model weights into memory rather than memory-mapping them (try this if weights are on a network mount)",
+    )
 
     batch_opts.add_argument(
         "--batch_autodetect",
@@ -578,6 +623,10 @@ def main():
         ram_monitor = RamMonitor()
         ram_monitor.start()
 
+        # Pipeline activations are logged at INFO, with RAM usage attached
+        logging.basicConfig(format="%(message)s")
+        logging.getLogger("gyre.manager").setLevel(logging.INFO)
+
     grpc = GrpcServer(args)
     grpc.start()
 
@@ -652,6 +701,9 @@ def main():
                 vram_optimisation_level=args.vram_optimisation_level,
                 enable_cuda=True,
                 enable_mps=args.enable_mps,
+                mmap_load=not args.disable_mmap_load,
+                fast_math=args.enable_fast_math,
+                pin_memory=args.pin_memory,
             ),
             batchMode=BatchMode(
                 autodetect=args.batch_autodetect,
@@ -661,6 +713,9 @@ def main():
             ),
             nsfw_behaviour=args.nsfw_behaviour,
             ram_monitor=ram_monitor,
+            max_active_pipelines=args.max_active_pipelines,
+            idle_ttl=args.pipeline_idle_ttl,
+            eviction_policy=args.eviction_policy,
         )
 
         print("Manager loaded")
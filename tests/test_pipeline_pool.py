@@ -0,0 +1,332 @@
+"""
+Unit tests for the active pipeline eviction policies and device slot queue.
+These don't need a GPU (or torch). Run with:
+
+    python -m unittest tests/test_pipeline_pool.py
+"""
+
+import os, sys, queue, threading, time, unittest
+from types import SimpleNamespace as SN
+from unittest import mock
+
+basePath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(basePath)
+
+from gyre import pipeline_pool
+from gyre.pipeline_pool import (
+    ActivePipelines,
+    CostPolicy,
+    DeviceSlotQueue,
+    LRUPolicy,
+    TwoQueuePolicy,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class ClockTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(pipeline_pool, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+def pipeline(footprint=1):
+    return SN(footprint=footprint)
+
+
+def slot(*active):
+    return SN(active=set(active))
+
+
+class TestLRUPolicy(unittest.TestCase):
+    def test_victim_is_least_recently_inserted(self):
+        policy = LRUPolicy()
+        for id in "abc":
+            policy.insert(id, 1)
+
+        self.assertEqual(policy.victim(), "a")
+
+    def test_touch_moves_to_most_recent(self):
+        policy = LRUPolicy()
+        for id in "abc":
+            policy.insert(id, 1)
+
+        policy.touch("a")
+        self.assertEqual(policy.victim(), "b")
+
+        policy.remove("b")
+        self.assertEqual(policy.victim(), "c")
+
+
+class TestTwoQueuePolicy(unittest.TestCase):
+    def test_probation_evicted_before_main(self):
+        policy = TwoQueuePolicy()
+        policy.insert("a", 1)
+        policy.touch("a")  # promoted to main
+        policy.insert("b", 1)
+
+        self.assertEqual(policy.victim(), "b")
+
+        policy.remove("b")
+        self.assertEqual(policy.victim(), "a")
+
+    def test_probation_is_fifo(self):
+        policy = TwoQueuePolicy()
+        policy.insert("a", 1)
+        policy.insert("b", 1)
+
+        self.assertEqual(policy.victim(), "a")
+
+    def test_main_is_lru(self):
+        policy = TwoQueuePolicy()
+        for id in "ab":
+            policy.insert(id, 1)
+            policy.touch(id)
+
+        policy.touch("a")
+        self.assertEqual(policy.victim(), "b")
+
+    def test_evicted_probationer_returns_to_main(self):
+        policy = TwoQueuePolicy()
+        policy.insert("a", 1)
+        policy.remove("a")  # remembered as a ghost
+
+        policy.insert("a", 1)
+        policy.insert("b", 1)
+
+        # b is on probation, a went straight to main
+        self.assertEqual(policy.victim(), "b")
+        policy.remove("b")
+        self.assertEqual(policy.victim(), "a")
+
+    def test_evicted_main_entry_is_not_a_ghost(self):
+        policy = TwoQueuePolicy()
+        policy.insert("a", 1)
+        policy.touch("a")
+        policy.remove("a")
+
+        policy.insert("a", 1)
+        policy.insert("b", 1)
+        self.assertEqual(policy.victim(), "a")
+
+    def test_ghosts_are_bounded(self):
+        policy = TwoQueuePolicy(ghost_size=2)
+        for id in "abc":
+            policy.insert(id, 1)
+            policy.remove(id)
+
+        # a has been forgotten, so comes back on probation
+        policy.insert("a", 1)
+        policy.insert("c", 1)
+        self.assertEqual(policy.victim(), "a")
+
+
+class TestCostPolicy(ClockTestCase):
+    def test_cheapest_per_idle_second_is_victim(self):
+        policy = CostPolicy()
+        policy.insert("big", 100)
+        policy.insert("small", 10)
+
+        self.clock.now += 1
+        self.assertEqual(policy.victim(), "small")
+
+    def test_long_idle_big_pipeline_is_victim(self):
+        policy = CostPolicy()
+        policy.insert("big", 100)
+        self.clock.now += 100
+        policy.insert("small", 10)
+
+        self.clock.now += 1
+        # big: 100 / 101s, small: 10 / 1s
+        self.assertEqual(policy.victim(), "big")
+
+    def test_touch_resets_idle_time(self):
+        policy = CostPolicy()
+        policy.insert("a", 10)
+        policy.insert("b", 10)
+
+        self.clock.now += 10
+        policy.touch("a")
+        self.clock.now += 1
+        self.assertEqual(policy.victim(), "b")
+
+
+class TestActivePipelines(ClockTestCase):
+    def test_pop_victim_uses_policy(self):
+        active = ActivePipelines(2, LRUPolicy())
+        a, b = pipeline(), pipeline()
+        active["a"] = a
+        active["b"] = b
+        active.get("a")
+
+        self.assertIs(active.pop_victim(), b)
+        self.assertEqual(len(active), 1)
+        self.assertNotIn("b", active)
+
+    def test_passes_footprint_as_cost(self):
+        active = ActivePipelines(2, CostPolicy())
+        active["big"] = pipeline(100)
+        active["small"] = pipeline(10)
+
+        self.clock.now += 1
+        self.assertEqual(active.policy.victim(), "small")
+
+    def test_reinsert_replaces(self):
+        active = ActivePipelines(2)
+        first, second = pipeline(), pipeline()
+        active["a"] = first
+        active["a"] = second
+
+        self.assertEqual(len(active), 1)
+        self.assertIs(active.get("a"), second)
+        self.assertIs(active.pop_victim(), second)
+
+    def test_idle_since(self):
+        active = ActivePipelines(3)
+        for id in "abc":
+            active[id] = pipeline()
+            self.clock.now += 10
+
+        self.assertEqual(active.idle_since(self.clock.now - 15), ["a", "b"])
+
+        # Releasing a pipeline makes it recent again
+        active.touch("a")
+        self.assertEqual(active.idle_since(self.clock.now - 15), ["b"])
+        self.assertEqual(active.idle_since(self.clock.now + 1), ["b", "c", "a"])
+
+    def test_idle_since_forgets_popped(self):
+        active = ActivePipelines(2)
+        active["a"] = pipeline()
+        active.pop("a")
+
+        self.clock.now += 10
+        self.assertEqual(active.idle_since(self.clock.now), [])
+
+
+class TestDeviceSlotQueue(unittest.TestCase):
+    def waiting(self, q, *ids):
+        tickets = [object() for _ in ids]
+        q._waiting.extend(zip(tickets, ids))
+        return tickets
+
+    def test_get_nowait(self):
+        q = DeviceSlotQueue()
+        with self.assertRaises(queue.Empty):
+            q.get_nowait()
+
+        first, second = slot(), slot()
+        q.put(first)
+        q.put(second)
+        self.assertIs(q.get_nowait(), second)
+        self.assertIs(q.get_nowait(), first)
+
+    def test_prefers_most_recently_released(self):
+        q = DeviceSlotQueue()
+        first, second = slot(), slot()
+        q.put(first)
+        q.put(second)
+
+        self.assertIs(q.get("a"), second)
+
+    def test_prefers_slot_with_engine_active(self):
+        q = DeviceSlotQueue()
+        with_a, without_a = slot("a"), slot("b")
+        q.put(with_a)
+        q.put(without_a)
+
+        self.assertIs(q.get("a"), with_a)
+
+    def test_oldest_request_can_always_take(self):
+        q = DeviceSlotQueue()
+        q.put(slot("b"))
+        head, _ = self.waiting(q, "a", "b")
+
+        self.assertIsNotNone(q._pick(head, "a"))
+
+    def test_others_only_take_active_engine(self):
+        q = DeviceSlotQueue()
+        q.put(slot("b"))
+        _, other, active = self.waiting(q, "a", "c", "b")
+
+        self.assertIsNone(q._pick(other, "c"))
+        self.assertIsNotNone(q._pick(active, "b"))
+
+    def test_burst_is_capped(self):
+        q = DeviceSlotQueue(max_burst=2)
+        s = slot("b")
+        q.put(s)
+        head, *others = self.waiting(q, "a", "b", "b", "b")
+
+        self.assertIs(q._pick(others[0], "b"), s)
+        self.assertIs(q._pick(others[1], "b"), s)
+        self.assertIsNone(q._pick(others[2], "b"))
+
+        # Once the oldest request has had the slot, a new burst can start
+        self.assertIs(q._pick(head, "a"), s)
+        self.assertIs(q._pick(others[2], "b"), s)
+
+    def test_waiters_served_in_order(self):
+        q = DeviceSlotQueue()
+        q.put(slot())
+        order = []
+
+        def request(id):
+            taken = q.get(id)
+            order.append(id)
+            q.put(taken)
+
+        held = q.get("x")
+        threads = []
+        for id in "abc":
+            thread = threading.Thread(target=request, args=(id,))
+            thread.start()
+            threads.append(thread)
+            # Make sure each request is queued before the next
+            while len(q._waiting) < len(threads):
+                time.sleep(0.001)
+
+        q.put(held)
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(order, ["a", "b", "c"])
+        self.assertIs(q.get_nowait(), held)
+
+    def test_remaining_slot_goes_to_new_oldest(self):
+        q = DeviceSlotQueue()
+        q.put(slot())
+        q.put(slot())
+        held = [q.get("x"), q.get("x")]
+        taken = []
+
+        threads = [
+            threading.Thread(target=lambda id=id: taken.append(q.get(id)))
+            for id in "ab"
+        ]
+        for i, thread in enumerate(threads):
+            thread.start()
+            while len(q._waiting) < i + 1:
+                time.sleep(0.001)
+
+        # Release both at once: b (not oldest, no engine active) must still
+        # get the second slot once a has taken the first
+        with q._cond:
+            q._free.extend(held)
+            q._cond.notify_all()
+
+        for thread in threads:
+            thread.join(5)
+
+        self.assertCountEqual(taken, held)
+
+
+if __name__ == "__main__":
+    unittest.main()